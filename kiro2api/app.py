@@ -1,21 +1,28 @@
 import time
 import json
+import hashlib
+import email.message
 import logging
 import asyncio
 import httpx
+import orjson
 from contextlib import asynccontextmanager
+from typing import Optional
 from fastapi import FastAPI, HTTPException, Depends, Request
-from fastapi.responses import StreamingResponse
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import StreamingResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from sse_starlette.sse import EventSourceResponse
+from pydantic import ValidationError
 
 from config import MODEL_MAP, KIRO_BASE_URL, get_register_config
 from models import ChatCompletionRequest
 from models.claude_schemas import ClaudeRequest
 from auth import verify_api_key, token_manager
 from services import create_non_streaming_response, create_streaming_response
+from services import get_http_client, close_http_client
 from services.claude_converter import convert_claude_to_codewhisperer_request
-from services.claude_stream_handler import ClaudeStreamHandler
+from services.claude_stream_handler import ClaudeStreamHandler, build_claude_error_event
 from storage import init_db, close_db, AccountStore, get_db
 from register import task_manager, RegisterTask, auto_register, AutoRegisterOptions
 
@@ -24,6 +31,82 @@ logging.basicConfig(level=logging.INFO)  # for dev
 # logging.basicConfig(level=logging.WARNING)
 logger = logging.getLogger(__name__)
 
+# 固定内容的 Claude SSE 错误事件，模块加载时构建一次
+_SSE_TOKEN_REFRESH_FAILED = build_claude_error_event("authentication_error", "Token refresh failed")
+_SSE_ALL_RATE_LIMITED = build_claude_error_event("rate_limit_error", "All accounts rate limited. Please try again later.")
+
+# /v1/models 响应体缓存：(生成时间, 序列化后的 JSON, ETag)；MODEL_MAP 是静态的，只需定期刷新 created 字段
+_MODELS_CACHE_TTL = 60
+_models_cache: tuple = (0, b"", "")
+# /health 响应内容固定，启动时序列化一次
+_HEALTH_BODY = orjson.dumps({"status": "healthy", "service": "Ki2API", "version": "3.2.0"})
+
+# 手动解析请求体的端点在 OpenAPI 文档中引用的模型 schema，生成文档时合并进 components
+_openapi_body_schemas: dict = {}
+
+
+def _json_body_openapi(model: type) -> dict:
+    """为直接读取原始请求体的端点生成 openapi_extra，补上请求体的文档"""
+    schema = model.model_json_schema(ref_template="#/components/schemas/{model}")
+    _openapi_body_schemas.update(schema.pop("$defs", {}))
+    _openapi_body_schemas[model.__name__] = schema
+    return {
+        "requestBody": {
+            "required": True,
+            "content": {"application/json": {"schema": {"$ref": f"#/components/schemas/{model.__name__}"}}},
+        }
+    }
+
+
+def _is_json_content_type(content_type: Optional[str]) -> bool:
+    """与 FastAPI 相同的判断：application/json 或 application/*+json"""
+    if not content_type:
+        return False
+    message = email.message.Message()
+    message["content-type"] = content_type
+    if message.get_content_maintype() != "application":
+        return False
+    subtype = message.get_content_subtype()
+    return subtype == "json" or subtype.endswith("+json")
+
+
+async def _validate_json_body(raw_request: Request, model: type):
+    """按 FastAPI 绑定模型参数的规则读取并校验请求体，JSON 用 orjson 解析
+
+    Content-Type 不是 JSON 时不解析请求体；空请求体或 null 视为缺少请求体；
+    校验失败时抛出的 RequestValidationError 与 FastAPI 的 422 响应格式一致（loc 以 "body" 开头）。
+    """
+    body = await raw_request.body()
+    data = None
+    if body:
+        if _is_json_content_type(raw_request.headers.get("content-type")):
+            try:
+                data = orjson.loads(body)
+            except orjson.JSONDecodeError:
+                # orjson 拒绝而标准库接受的输入（如 NaN、超过 64 位的整数）交给标准库，
+                # 真正无效的 JSON 由标准库给出与 FastAPI 相同的错误位置和信息
+                try:
+                    data = json.loads(body)
+                except json.JSONDecodeError as e:
+                    raise RequestValidationError([{
+                        "type": "json_invalid",
+                        "loc": ("body", e.pos),
+                        "msg": "JSON decode error",
+                        "input": {},
+                        "ctx": {"error": e.msg},
+                    }], body=e.doc)
+        else:
+            data = body
+    if data is None:
+        raise RequestValidationError([{"type": "missing", "loc": ("body",), "msg": "Field required", "input": None}])
+    try:
+        return model.model_validate(data, from_attributes=True)
+    except ValidationError as e:
+        raise RequestValidationError(
+            [{**err, "loc": ("body", *err["loc"])} for err in e.errors(include_url=False)],
+            body=data,
+        )
+
 
 async def execute_register_task(task: RegisterTask) -> dict:
     """执行注册任务的回调函数"""
@@ -56,6 +139,10 @@ async def lifespan(app: FastAPI):
     
     yield
     
+    # 关闭复用的 HTTP 客户端
+    await close_http_client()
+    await token_manager.close()
+    
     # 关闭时清理数据库连接
     await close_db()
     logger.info("数据库连接已关闭")
@@ -69,6 +156,17 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+
+def _openapi_with_body_schemas() -> dict:
+    """在默认 OpenAPI 文档中补充 _json_body_openapi 引用的请求体模型"""
+    if app.openapi_schema is None:
+        schema = FastAPI.openapi(app)
+        schema.setdefault("components", {}).setdefault("schemas", {}).update(_openapi_body_schemas)
+    return app.openapi_schema
+
+
+app.openapi = _openapi_with_body_schemas
+
 # 添加 CORS 中间件
 app.add_middleware(
     CORSMiddleware,
@@ -80,29 +178,46 @@ app.add_middleware(
 
 
 @app.get("/v1/models")
-async def list_models(api_key: str = Depends(verify_api_key)):
+async def list_models(request: Request, api_key: str = Depends(verify_api_key)):
     """List available models"""
-    return {
-        "object": "list",
-        "data": [
-            {
-                "id": model_id,
-                "object": "model",
-                "created": int(time.time()),
-                "owned_by": "ki2api"
-            }
-            for model_id in MODEL_MAP.keys()
-        ]
-    }
-
-
-@app.post("/v1/chat/completions")
+    global _models_cache
+    now = int(time.time())
+    if now - _models_cache[0] >= _MODELS_CACHE_TTL:
+        body = orjson.dumps({
+            "object": "list",
+            "data": [
+                {
+                    "id": model_id,
+                    "object": "model",
+                    "created": now,
+                    "owned_by": "ki2api"
+                }
+                for model_id in MODEL_MAP.keys()
+            ]
+        })
+        # ETag 随响应体一起在重建时计算一次
+        _models_cache = (now, body, f'"{hashlib.md5(body, usedforsecurity=False).hexdigest()}"')
+    _, body, etag = _models_cache
+    headers = {"ETag": etag}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (
+        if_none_match.strip() == "*"
+        or etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+    ):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+@app.post("/v1/chat/completions", openapi_extra=_json_body_openapi(ChatCompletionRequest))
 async def create_chat_completion(
-    request: ChatCompletionRequest,
+    raw_request: Request,
     api_key: str = Depends(verify_api_key)
 ):
     """Create a chat completion"""
-    logger.info(f"📥 COMPLETE REQUEST: {request.model_dump_json(indent=2)}")
+    request = await _validate_json_body(raw_request, ChatCompletionRequest)
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("📥 COMPLETE REQUEST: %s", request.model_dump_json())
 
     # Validate messages have content
     for i, msg in enumerate(request.messages):
@@ -134,7 +249,7 @@ async def create_chat_completion(
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
-    return {"status": "healthy", "service": "Ki2API", "version": "3.2.0"}
+    return Response(content=_HEALTH_BODY, media_type="application/json")
 
 
 @app.get("/v1/token/status")
@@ -161,22 +276,27 @@ async def reset_tokens(api_key: str = Depends(verify_api_key)):
 # Claude API 兼容端点
 # ============================================================================
 
-@app.post("/v1/messages")
+@app.post("/v1/messages", openapi_extra=_json_body_openapi(ClaudeRequest))
 async def create_message(
-    request: ClaudeRequest,
+    raw_request: Request,
     api_key: str = Depends(verify_api_key)
 ):
     """
     Claude API 兼容的消息创建端点
     参考 amazonq2api 模块实现
     """
-    logger.info(f"📥 收到 Claude API 请求: model={request.model}, stream={request.stream}")
-    logger.debug(f"📥 完整请求: {request.model_dump_json(indent=2)}")
+    # 与 /v1/chat/completions 相同，请求体用 orjson 解析后校验
+    request = await _validate_json_body(raw_request, ClaudeRequest)
+    
+    logger.info("📥 收到 Claude API 请求: model=%s, stream=%s", request.model, request.stream)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("📥 完整请求: %s", request.model_dump_json())
     
     try:
         # 转换为 CodeWhisperer 请求
         codewhisperer_request = convert_claude_to_codewhisperer_request(request)
-        logger.debug(f"🔄 转换后的请求: {json.dumps(codewhisperer_request, indent=2, ensure_ascii=False)[:2000]}...")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("🔄 转换后的请求: %s...", orjson.dumps(codewhisperer_request, option=orjson.OPT_INDENT_2).decode()[:2000])
         
         # 获取 token
         token = await token_manager.get_token()
@@ -201,12 +321,13 @@ async def create_message(
         # 流式响应
         async def generate_stream():
             handler = ClaudeStreamHandler(request.model, request)
-            max_retries = 3
-            
-            timeout = httpx.Timeout(connect=30.0, read=None, write=30.0, pool=30.0)
-            
-            async with httpx.AsyncClient(timeout=timeout) as client:
+            try:
+                max_retries = 3
+                
+                client = get_http_client()
                 current_headers = headers.copy()
+                # 请求体只用 orjson 序列化一次，重试时复用
+                body = orjson.dumps(codewhisperer_request)
                 
                 for attempt in range(max_retries):
                     try:
@@ -214,7 +335,7 @@ async def create_message(
                             "POST",
                             KIRO_BASE_URL,
                             headers=current_headers,
-                            json=codewhisperer_request
+                            content=body
                         ) as response:
                             logger.info(f"📤 STREAM RESPONSE STATUS: {response.status_code} (attempt {attempt + 1})")
                             
@@ -231,7 +352,7 @@ async def create_message(
                                     if new_token:
                                         current_headers["Authorization"] = f"Bearer {new_token}"
                                         continue
-                                    yield f'event: error\ndata: {{"type":"error","error":{{"type":"authentication_error","message":"Token refresh failed"}}}}\n\n'
+                                    yield _SSE_TOKEN_REFRESH_FAILED
                                     return
                             
                             # 处理 429 - 速率限制
@@ -246,36 +367,37 @@ async def create_message(
                                         logger.info("已切换到新账号，重试请求...")
                                         continue
                                 
-                                yield f'event: error\ndata: {{"type":"error","error":{{"type":"rate_limit_error","message":"All accounts rate limited. Please try again later."}}}}\n\n'
+                                yield _SSE_ALL_RATE_LIMITED
                                 return
                             
                             if response.status_code != 200:
                                 error_text = await response.aread()
                                 logger.error(f"API 错误: {response.status_code} - {error_text}")
-                                yield f'event: error\ndata: {{"type":"error","error":{{"type":"api_error","message":"API error: {response.status_code}"}}}}\n\n'
+                                yield build_claude_error_event("api_error", f"API error: {response.status_code}")
                                 return
                             
-                            # 真正的流式处理
+                            # 真正的流式处理：同一次上游读取产生的所有事件合并为一次写出，减少逐事件的 send 调用
                             async for chunk in response.aiter_bytes():
-                                for event in handler.handle_chunk(chunk):
-                                    yield event
+                                events = b"".join(handler.handle_chunk(chunk))
+                                if events:
+                                    yield events
                             
                             # 发送收尾事件
-                            for event in handler.finalize():
-                                yield event
+                            yield b"".join(handler.finalize())
                             
                             return  # 成功完成
                     
                     except httpx.HTTPStatusError as e:
                         logger.error(f"HTTP ERROR in stream: {e}")
-                        yield f'event: error\ndata: {{"type":"error","error":{{"type":"api_error","message":"{str(e)}"}}}}\n\n'
+                        yield build_claude_error_event("api_error", str(e))
                         return
                     except Exception as e:
-                        logger.error(f"Stream error: {e}")
-                        import traceback
-                        traceback.print_exc()
-                        yield f'event: error\ndata: {{"type":"error","error":{{"type":"internal_error","message":"{str(e)}"}}}}\n\n'
+                        logger.exception("Stream error: %s", e)
+                        yield build_claude_error_event("internal_error", str(e))
                         return
+            finally:
+                # 解析器归还到池中，供后续请求复用
+                handler.close()
         
         return StreamingResponse(
             generate_stream(),
@@ -291,9 +413,7 @@ async def create_message(
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"处理请求时发生错误: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("处理请求时发生错误: %s", e)
         raise HTTPException(
             status_code=500,
             detail={
@@ -4,6 +4,7 @@
 """
 import os
 import json
+import functools
 import logging
 from typing import List, Optional
 from dataclasses import dataclass
@@ -44,9 +45,35 @@ def load_auth_configs() -> List[AuthConfig]:
         {"refreshToken": "token2", "name": "account2", "disabled": false}
     ]
     """
-    # 检查是否有新的 KIRO_AUTH_CONFIG 配置
     auth_config_env = os.getenv("KIRO_AUTH_CONFIG")
-    
+    configs = _load_auth_configs_cached(
+        auth_config_env,
+        os.getenv("KIRO_REFRESH_TOKEN"),
+        os.getenv("KIRO_ACCESS_TOKEN"),
+        _config_file_mtime(auth_config_env),
+    )
+    return list(configs)
+
+
+def _config_file_mtime(config_value: Optional[str]) -> Optional[int]:
+    """KIRO_AUTH_CONFIG 指向文件时返回其修改时间，使文件更新后缓存失效"""
+    if not config_value:
+        return None
+    try:
+        return os.stat(config_value).st_mtime_ns
+    except (OSError, ValueError):
+        return None
+
+
+@functools.lru_cache(maxsize=1)
+def _load_auth_configs_cached(
+    auth_config_env: Optional[str],
+    refresh_token_env: Optional[str],
+    access_token_env: Optional[str],
+    config_file_mtime: Optional[int],
+) -> List[AuthConfig]:
+    """按环境变量快照（以及配置文件修改时间）缓存解析结果，避免重复读取文件和解析 JSON"""
+    # 检查是否有新的 KIRO_AUTH_CONFIG 配置
     if auth_config_env:
         logger.info("检测到 KIRO_AUTH_CONFIG 环境变量")
         return _load_from_json_config(auth_config_env)
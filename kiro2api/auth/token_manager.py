@@ -7,13 +7,12 @@
 2. 配置文件（回退）- 从环境变量或 JSON 文件读取
 """
 import os
-import time
 import asyncio
 import logging
 import httpx
 from typing import Optional, List
 from dataclasses import dataclass, field
-from datetime import datetime, timedelta
+from datetime import datetime
 
 from .config import AuthConfig, load_auth_configs
 
@@ -56,6 +55,7 @@ class MultiAccountTokenManager:
 
     REFRESH_URL = "https://prod.us-east-1.auth.desktop.kiro.dev/refreshToken"
     TOKEN_TTL_SECONDS = 3300  # 55 分钟 TTL
+    REFRESH_BATCH_SIZE = 3  # 当前账号刷新失败时，每批同时刷新的其余账号数
 
     def __init__(self):
         self.configs: List[AuthConfig] = []
@@ -64,6 +64,19 @@ class MultiAccountTokenManager:
         self.refresh_lock = asyncio.Lock()
         self._initialized = False
         self._use_database = False  # 是否使用数据库
+        self._http: Optional[httpx.AsyncClient] = None  # 刷新 token 复用的 HTTP 客户端
+
+    def _get_http_client(self) -> httpx.AsyncClient:
+        """获取刷新 token 用的共享 HTTP 客户端，首次使用时创建"""
+        if self._http is None or self._http.is_closed:
+            self._http = httpx.AsyncClient(timeout=30)
+        return self._http
+
+    async def close(self):
+        """关闭共享的 HTTP 客户端（应用关闭时调用）"""
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
 
     async def initialize(self):
         """初始化管理器，加载配置并预热 token"""
@@ -195,37 +208,82 @@ class MultiAccountTokenManager:
             logger.error("没有可用的认证配置")
             return None
         
-        # 尝试所有配置
-        for _ in range(len(self.configs)):
+        # 快速路径：当前账号的缓存 token 可用时直接返回，不占用锁
+        cached = self.cached_tokens.get(self.configs[self.current_index].name)
+        if cached and cached.is_usable():
+            cached.last_used = datetime.now()
+            return cached.access_token
+        
+        # 需要刷新时加锁，避免并发请求同时刷新同一个账号；
+        # 拿到锁后会重新检查缓存，等待期间别的请求可能已经刷新完成
+        async with self.refresh_lock:
             config = self.configs[self.current_index]
-            cache_key = config.name
             
             # 检查缓存
-            cached = self.cached_tokens.get(cache_key)
-            
+            cached = self.cached_tokens.get(config.name)
             if cached and cached.is_usable():
                 # 使用缓存的 token
                 cached.last_used = datetime.now()
                 logger.debug(f"使用缓存 token: {config.name}")
                 return cached.access_token
             
-            # 需要刷新 token
-            try:
-                new_token = await self._refresh_single_token(config)
-                if new_token:
-                    self.cached_tokens[cache_key] = CachedToken(
-                        config=config,
-                        access_token=new_token
-                    )
-                    logger.info(f"刷新 token 成功: {config.name}")
-                    return new_token
-            except Exception as e:
-                logger.warning(f"刷新 token 失败 ({config.name}): {e}")
+            # 优先刷新当前账号，保持轮询位置不变
+            new_token = await self._refresh_and_cache(config)
+            if new_token:
+                return new_token
+            
+            # 当前账号不可用：先找其余账号中仍可用的缓存
+            other_indices = [
+                (self.current_index + offset) % len(self.configs)
+                for offset in range(1, len(self.configs))
+            ]
+            for index in other_indices:
+                cached = self.cached_tokens.get(self.configs[index].name)
+                if cached and cached.is_usable():
+                    self.current_index = index
+                    cached.last_used = datetime.now()
+                    logger.debug(f"使用缓存 token: {self.configs[index].name}")
+                    return cached.access_token
+            
+            # 其余账号按轮询顺序小批量并行刷新，等待时间按批数而不是账号数累加
+            new_token = await self._refresh_first_available(other_indices)
+            if new_token:
+                return new_token
             
-            # 当前配置失败，切换到下一个
-            self._move_to_next()
+            logger.error("所有 token 都不可用")
+            return None
+    
+    async def _refresh_and_cache(self, config: AuthConfig) -> Optional[str]:
+        """刷新单个账号并写入缓存，失败时返回 None"""
+        try:
+            new_token = await self._refresh_single_token(config)
+        except Exception as e:
+            logger.warning(f"刷新 token 失败 ({config.name}): {e}")
+            return None
         
-        logger.error("所有 token 都不可用")
+        if new_token:
+            self.cached_tokens[config.name] = CachedToken(
+                config=config,
+                access_token=new_token
+            )
+            logger.info(f"刷新 token 成功: {config.name}")
+        return new_token
+    
+    async def _refresh_first_available(self, indices: List[int]) -> Optional[str]:
+        """按轮询顺序分批并行刷新给定的账号，切换到第一个刷新成功的账号并返回其 token
+
+        每批最多 REFRESH_BATCH_SIZE 个账号，账号池很大时也不会同时向认证服务发出大量刷新请求。
+        同一批的刷新都会执行完而不是中途取消（刷新可能已经轮换了 refresh token），成功的结果都写入缓存。
+        """
+        for start in range(0, len(indices), self.REFRESH_BATCH_SIZE):
+            batch = indices[start:start + self.REFRESH_BATCH_SIZE]
+            results = await asyncio.gather(
+                *(self._refresh_and_cache(self.configs[index]) for index in batch)
+            )
+            for index, new_token in zip(batch, results):
+                if new_token:
+                    self.current_index = index
+                    return new_token
         return None
     
     async def refresh_tokens(self) -> Optional[str]:
@@ -275,22 +333,22 @@ class MultiAccountTokenManager:
     
     async def _refresh_kiro_token(self, config: AuthConfig) -> Optional[str]:
         """刷新 Kiro 账号的 token"""
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                self.REFRESH_URL,
-                json={"refreshToken": config.refresh_token},
-                timeout=30
-            )
-            response.raise_for_status()
-            
-            data = response.json()
-            access_token = data.get("accessToken")
-            
-            if not access_token:
-                logger.error(f"Kiro 刷新响应中没有 accessToken: {data}")
-                return None
-            
-            return access_token
+        client = self._get_http_client()
+        response = await client.post(
+            self.REFRESH_URL,
+            json={"refreshToken": config.refresh_token},
+            timeout=30
+        )
+        response.raise_for_status()
+        
+        data = response.json()
+        access_token = data.get("accessToken")
+        
+        if not access_token:
+            logger.error(f"Kiro 刷新响应中没有 accessToken: {data}")
+            return None
+        
+        return access_token
     
     async def _refresh_amazonq_token(self, config: AuthConfig) -> Optional[str]:
         """刷新 Amazon Q 账号的 token"""
@@ -314,24 +372,24 @@ class MultiAccountTokenManager:
             "grantType": "refresh_token",
         }
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                OIDC_TOKEN_URL,
-                headers=headers,
-                json=payload,
-                timeout=30
-            )
-            response.raise_for_status()
-            
-            data = response.json()
-            access_token = data.get("accessToken")
-            
-            if not access_token:
-                logger.error(f"Amazon Q 刷新响应中没有 accessToken: {data}")
-                return None
-            
-            logger.debug(f"Amazon Q token 刷新成功，有效期: {data.get('expiresIn')} 秒")
-            return access_token
+        client = self._get_http_client()
+        response = await client.post(
+            OIDC_TOKEN_URL,
+            headers=headers,
+            json=payload,
+            timeout=30
+        )
+        response.raise_for_status()
+        
+        data = response.json()
+        access_token = data.get("accessToken")
+        
+        if not access_token:
+            logger.error(f"Amazon Q 刷新响应中没有 accessToken: {data}")
+            return None
+        
+        logger.debug(f"Amazon Q token 刷新成功，有效期: {data.get('expiresIn')} 秒")
+        return access_token
     
     def mark_token_exhausted(self, reason: str = "unknown"):
         """
@@ -3,7 +3,6 @@ Claude API 数据结构定义
 参考 amazonq2api 模块的实现
 """
 
-import time
 import uuid
 from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any, Union
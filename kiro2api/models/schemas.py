@@ -1,7 +1,7 @@
 import time
 import uuid
 import logging
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr
 from typing import List, Optional, Dict, Any, Union
 
 logger = logging.getLogger(__name__)
@@ -30,8 +30,20 @@ class ChatMessage(BaseModel):
     tool_calls: Optional[List[ToolCall]] = None
     tool_call_id: Optional[str] = None  # 用于 tool 角色的消息
     
+    # get_content_text 的计算结果，消息在请求生命周期内不会被修改
+    _content_text_cache: Optional[str] = PrivateAttr(default=None)
+    
     def get_content_text(self) -> str:
         """Extract text content from either string or content parts"""
+        # 纯字符串内容（最常见的情况）直接返回，无需经过缓存
+        if isinstance(self.content, str):
+            return self.content
+        if self._content_text_cache is None:
+            self._content_text_cache = self._extract_content_text()
+        return self._content_text_cache
+    
+    def _extract_content_text(self) -> str:
+        """Walk the content parts and join their text"""
         # Handle None content
         if self.content is None:
             logger.warning(f"Message with role '{self.role}' has None content")
@@ -40,6 +52,9 @@ class ChatMessage(BaseModel):
         if isinstance(self.content, str):
             return self.content
         elif isinstance(self.content, list):
+            # 校验后的内容都是 ContentPart，直接拼接；只有混入原始 dict 时才逐个判断
+            if not any(isinstance(part, dict) for part in self.content):
+                return "".join([part.text for part in self.content if getattr(part, 'text', None)])
             text_parts = []
             for part in self.content:
                 if isinstance(part, dict):
@@ -120,9 +135,10 @@ class ChatCompletionResponse(BaseModel):
 
 
 class ChatCompletionStreamResponse(BaseModel):
-    id: str = Field(default_factory=lambda: f"chatcmpl-{uuid.uuid4()}")
+    # 同一个流的所有分块共享 id/created，由调用方在流开始时生成一次后传入
+    id: str
     object: str = "chat.completion.chunk"
-    created: int = Field(default_factory=lambda: int(time.time()))
+    created: int
     model: str
     system_fingerprint: Optional[str] = "fp_ki2api_v3"
     choices: List[StreamChoice]
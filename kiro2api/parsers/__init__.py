@@ -1,23 +1,34 @@
 from .xml_parser import parse_xml_tool_calls
 from .bracket_parser import (
     find_matching_bracket,
+    scan_matching_bracket,
     parse_single_tool_call_professional,
     parse_bracket_tool_calls_professional,
+    parse_bracket_tool_calls_with_spans,
     parse_bracket_tool_calls,
     parse_single_tool_call,
     deduplicate_tool_calls,
 )
-from .stream_parser import CodeWhispererStreamParser, SimpleResponseParser
+from .stream_parser import (
+    CodeWhispererStreamParser,
+    SimpleResponseParser,
+    acquire_parser,
+    release_parser,
+)
 
 __all__ = [
     "parse_xml_tool_calls",
     "find_matching_bracket",
+    "scan_matching_bracket",
     "parse_single_tool_call_professional",
     "parse_bracket_tool_calls_professional",
+    "parse_bracket_tool_calls_with_spans",
     "parse_bracket_tool_calls",
     "parse_single_tool_call",
     "deduplicate_tool_calls",
     "CodeWhispererStreamParser",
     "SimpleResponseParser",
+    "acquire_parser",
+    "release_parser",
 ]
 
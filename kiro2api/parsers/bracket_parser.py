@@ -1,75 +1,96 @@
 import re
-import json
-import uuid
+import secrets
 import logging
-from typing import Optional, List, Union
-from json_repair import repair_json
+from typing import Optional, List, Tuple, Union
+import orjson
 
 from models.schemas import ToolCall
 
 logger = logging.getLogger(__name__)
 
+# scan_matching_bracket 的词法单元：转义序列（反斜杠连同下一个字符）、引号和方括号
+_BRACKET_TOKEN_RE = re.compile(r'\\.|["\[\]]', re.DOTALL)
 
-def find_matching_bracket(text: str, start_pos: int) -> int:
-    """找到匹配的结束括号位置，正确处理嵌套括号和字符串内的括号"""
-    if not text or start_pos >= len(text) or text[start_pos] != '[':
-        return -1
-    
-    bracket_count = 1
-    in_string = False
-    escape_next = False
+# 从 [Called xxx with args: 中提取函数名
+_CALLED_NAME_RE = re.compile(r'\[Called\s+(\w+)\s+with\s+args:', re.IGNORECASE)
+
+# 批量解析时定位每个 [Called，同时顺带取出紧随其后的函数名（可能没有）
+_CALLED_START_RE = re.compile(r'\[Called(?i:\s+(\w+)\s+with\s+args:)?')
+
+
+def scan_matching_bracket(
+    text: str, pos: int, depth: int, in_string: bool, end_pos: Optional[int] = None
+) -> Tuple[int, int, int, bool]:
+    """可恢复的括号匹配扫描：从 pos 开始，带着已有的括号深度和字符串状态继续查找
+
+    返回 (结束括号位置, 下次继续扫描的位置, 括号深度, 是否在字符串内)，未闭合时结束位置为 -1。
+    文本在末尾追加内容后，调用方可以带着后三个值继续扫描，已扫过的部分不会重复处理。
+
+    用一个 finditer 在 C 层切出转义序列、引号和方括号，普通字符不进入 Python 循环；
+    转义序列作为整体匹配，字符串内的 \\" 不会被当作字符串结束。
+    """
+    if end_pos is None:
+        end_pos = len(text)
+    last_end = pos
     
-    for i in range(start_pos + 1, len(text)):
-        char = text[i]
+    for match in _BRACKET_TOKEN_RE.finditer(text, pos, end_pos):
+        token = match.group()
+        last_end = match.end()
         
-        if escape_next:
-            escape_next = False
-            continue
+        if len(token) == 2:
+            # 字符串内的转义整体跳过；字符串外反斜杠只是普通字符，按其后的字符处理
+            if in_string:
+                continue
+            token = token[1]
         
-        if char == '\\' and in_string:
-            escape_next = True
-            continue
-        
-        if char == '"' and not escape_next:
+        if token == '"':
             in_string = not in_string
-            continue
-        
-        if not in_string:
-            if char == '[':
-                bracket_count += 1
-            elif char == ']':
-                bracket_count -= 1
-                if bracket_count == 0:
-                    return i
+        elif not in_string:
+            if token == '[':
+                depth += 1
+            elif token == ']':
+                depth -= 1
+                if depth == 0:
+                    return last_end - 1, last_end, 0, in_string
     
-    return -1
+    # 末尾落单的反斜杠可能与后续内容的首字符组成转义，下次从它开始扫描
+    if last_end < end_pos and text[end_pos - 1] == '\\':
+        end_pos -= 1
+    return -1, end_pos, depth, in_string
 
 
-def parse_single_tool_call_professional(tool_call_text: str) -> Optional[ToolCall]:
-    """专业的工具调用解析器 - 使用json_repair库"""
-    logger.info(f"🔧 开始解析工具调用文本 (长度: {len(tool_call_text)})")
+def find_matching_bracket(text: str, start_pos: int, end_pos: Optional[int] = None) -> int:
+    """找到匹配的结束括号位置，正确处理嵌套括号和字符串内的括号
 
-    # 步骤1: 提取函数名
-    name_pattern = r'\[Called\s+(\w+)\s+with\s+args:'
-    name_match = re.search(name_pattern, tool_call_text, re.IGNORECASE)
+    给出 end_pos 时只在 text[start_pos:end_pos] 范围内查找。
+    """
+    if not text or start_pos >= len(text) or text[start_pos] != '[':
+        return -1
+    return scan_matching_bracket(text, start_pos + 1, 1, False, end_pos)[0]
 
-    if not name_match:
-        logger.warning("⚠️ 无法从文本中提取函数名")
-        return None
 
-    function_name = name_match.group(1).strip()
-    logger.info(f"✅ 提取到函数名: {function_name}")
+def parse_single_tool_call_professional(
+    tool_call_text: str, function_name: Optional[str] = None, args_start: Optional[int] = None
+) -> Optional[ToolCall]:
+    """专业的工具调用解析器 - 使用json_repair库
 
-    # 步骤2: 提取JSON参数部分
-    # 找到 "with args:" 之后的位置
-    args_start_marker = "with args:"
-    args_start_pos = tool_call_text.lower().find(args_start_marker.lower())
-    if args_start_pos == -1:
-        logger.error("❌ 找不到 'with args:' 标记")
-        return None
+    调用方已经匹配过 "[Called xxx with args:" 时，可以传入函数名和参数在文本中的起始位置，省去再次搜索。
+    """
+    logger.debug("🔧 开始解析工具调用文本 (长度: %d)", len(tool_call_text))
 
-    # 从 "with args:" 后开始
-    args_start = args_start_pos + len(args_start_marker)
+    # 步骤1: 提取函数名，同一次匹配也给出 "with args:" 的结束位置
+    if function_name is None or args_start is None:
+        name_match = _CALLED_NAME_RE.search(tool_call_text)
+        if not name_match:
+            logger.warning("⚠️ 无法从文本中提取函数名或 'with args:' 标记")
+            return None
+        function_name = name_match.group(1)
+        args_start = name_match.end()
+
+    function_name = function_name.strip()
+    logger.debug("✅ 提取到函数名: %s", function_name)
+
+    # 步骤2: 提取JSON参数部分，从 "with args:" 后开始
 
     # 找到最后的 ']'
     args_end = tool_call_text.rfind(']')
@@ -79,22 +100,36 @@ def parse_single_tool_call_professional(tool_call_text: str) -> Optional[ToolCal
 
     # 提取可能包含JSON的部分
     json_candidate = tool_call_text[args_start:args_end].strip()
-    logger.info(f"📝 提取的JSON候选文本长度: {len(json_candidate)}")
+    logger.debug("📝 提取的JSON候选文本长度: %d", len(json_candidate))
 
     # 步骤3: 修复并解析JSON
     try:
-        # 使用json_repair修复可能损坏的JSON
-        repaired_json = repair_json(json_candidate)
-        logger.info(f"🔧 JSON修复完成，修复后长度: {len(repaired_json)}")
+        # 合法 JSON 直接解析；失败时先裁剪到最外层的 {...}，再只调用一次 json_repair
+        clean_json = True
+        try:
+            parsed_args = orjson.loads(json_candidate)
+        except ValueError:
+            clean_json = False
+            repair_candidate = json_candidate
+            first_brace = json_candidate.find('{')
+            last_brace = json_candidate.rfind('}')
+            if first_brace != -1 and last_brace > first_brace:
+                repair_candidate = json_candidate[first_brace:last_brace + 1]
+            # json_repair 只在参数不是合法 JSON 时才需要，延迟到首次使用时导入
+            from json_repair import repair_json
+            parsed_args = repair_json(repair_candidate, return_objects=True)
+            logger.debug("🔧 JSON修复完成")
+        logger.debug("✅ JSON解析成功，类型: %s", type(parsed_args))
 
-        # 解析修复后的JSON
-        parsed_args = json.loads(repaired_json)
-        logger.info(f"✅ JSON解析成功，类型: {type(parsed_args)}")
+        # 参数本身就是合法的 JSON 对象时原样使用，无需重新序列化
+        arguments_json = None
 
         # Handle both dictionary and list formats
         if isinstance(parsed_args, dict):
             # Original format: direct dictionary
             arguments = parsed_args
+            if clean_json:
+                arguments_json = json_candidate
         elif isinstance(parsed_args, list) and len(parsed_args) > 0:
             # New format: list with arguments as first element
             if isinstance(parsed_args[0], dict):
@@ -106,85 +141,44 @@ def parse_single_tool_call_professional(tool_call_text: str) -> Optional[ToolCal
             logger.error(f"❌ 解析结果格式不支持: {type(parsed_args)}")
             return None
 
-        # 创建工具调用对象
-        tool_call_id = f"call_{uuid.uuid4().hex[:8]}"
-        tool_call = ToolCall(
+        # 创建工具调用对象（字段均由本函数生成，跳过 Pydantic 校验）
+        tool_call_id = f"call_{secrets.token_hex(4)}"
+        tool_call = ToolCall.model_construct(
             id=tool_call_id,
             type="function",
             function={
                 "name": function_name,
-                "arguments": json.dumps(arguments, ensure_ascii=False)
+                "arguments": arguments_json or orjson.dumps(arguments).decode()
             }
         )
 
-        logger.info(f"✅ 成功创建工具调用: {function_name} (参数键: {list(arguments.keys())})")
+        logger.debug("✅ 成功创建工具调用: %s (参数键: %s)", function_name, list(arguments))
         return tool_call
 
     except Exception as e:
         logger.error(f"❌ JSON修复/解析失败: {type(e).__name__}: {str(e)}")
-
-        # 备用方案：尝试更激进的修复
-        try:
-            # 查找第一个 { 和最后一个 }
-            first_brace = json_candidate.find('{')
-            last_brace = json_candidate.rfind('}')
-
-            if first_brace != -1 and last_brace > first_brace:
-                core_json = json_candidate[first_brace:last_brace + 1]
-
-                # 再次尝试修复
-                repaired_core = repair_json(core_json)
-                parsed_args = json.loads(repaired_core)
-
-                # Handle both dictionary and list formats in backup method too
-                if isinstance(parsed_args, dict):
-                    arguments = parsed_args
-                elif isinstance(parsed_args, list) and len(parsed_args) > 0 and isinstance(parsed_args[0], dict):
-                    arguments = parsed_args[0]
-                else:
-                    logger.error(f"❌ 备用方案解析结果格式不支持: {type(parsed_args)}")
-                    return None
-
-                tool_call_id = f"call_{uuid.uuid4().hex[:8]}"
-                tool_call = ToolCall(
-                    id=tool_call_id,
-                    type="function",
-                    function={
-                        "name": function_name,
-                        "arguments": json.dumps(arguments, ensure_ascii=False)
-                    }
-                )
-                logger.info(f"✅ 备用方案成功: {function_name}")
-                return tool_call
-
-        except Exception as backup_error:
-            logger.error(f"❌ 备用方案也失败了: {backup_error}")
-
         return None
 
 
-def parse_bracket_tool_calls_professional(response_text: str) -> Optional[List[ToolCall]]:
-    """专业的批量工具调用解析器"""
+def parse_bracket_tool_calls_with_spans(response_text: str) -> List[Tuple[ToolCall, int, int]]:
+    """批量解析工具调用，同时返回每个调用在原文中的位置 (tool_call, start, end)，end 不包含在内
+
+    调用方可以按这些位置把工具调用文本从响应中切除，无需再逐个用正则匹配。
+    """
     if not response_text or "[Called" not in response_text:
-        logger.info("📭 响应文本中没有工具调用标记")
-        return None
+        logger.debug("📭 响应文本中没有工具调用标记")
+        return []
     
     tool_calls = []
     errors = []
     
     # 方法1: 使用改进的分割方法
     try:
-        # 找到所有 [Called 的位置
-        call_positions = []
-        start = 0
-        while True:
-            pos = response_text.find("[Called", start)
-            if pos == -1:
-                break
-            call_positions.append(pos)
-            start = pos + 1
+        # 找到所有 [Called 的位置，以及能直接识别出的函数名
+        call_matches = list(_CALLED_START_RE.finditer(response_text))
+        call_positions = [match.start() for match in call_matches]
         
-        logger.info(f"🔍 找到 {len(call_positions)} 个潜在的工具调用")
+        logger.debug("🔍 找到 %d 个潜在的工具调用", len(call_positions))
         
         for i, start_pos in enumerate(call_positions):
             # 确定这个工具调用的结束位置
@@ -194,64 +188,65 @@ def parse_bracket_tool_calls_professional(response_text: str) -> Optional[List[T
             else:
                 end_search_limit = len(response_text)
             
-            # 在限定范围内查找结束的 ]
-            segment = response_text[start_pos:end_search_limit]
-            
-            # 查找匹配的结束括号
-            bracket_count = 0
-            end_pos = -1
-            
-            for j, char in enumerate(segment):
-                if char == '[':
-                    bracket_count += 1
-                elif char == ']':
-                    bracket_count -= 1
-                    if bracket_count == 0:
-                        end_pos = start_pos + j
-                        break
+            # 在限定范围内查找匹配的结束括号，忽略 JSON 字符串内的括号
+            end_pos = find_matching_bracket(response_text, start_pos, end_search_limit)
             
             if end_pos == -1:
                 # 如果没找到匹配的括号，尝试找最后一个 ]
-                last_bracket = segment.rfind(']')
+                last_bracket = response_text.rfind(']', start_pos, end_search_limit)
                 if last_bracket != -1:
-                    end_pos = start_pos + last_bracket
+                    end_pos = last_bracket
                 else:
                     logger.warning(f"⚠️ 工具调用 {i+1} 没有找到结束括号")
                     continue
             
             # 提取工具调用文本
             tool_call_text = response_text[start_pos:end_pos + 1]
-            logger.info(f"📋 提取工具调用 {i+1}, 长度: {len(tool_call_text)}")
+            logger.debug("📋 提取工具调用 %d, 长度: %d", i + 1, len(tool_call_text))
             
-            # 解析单个工具调用
-            parsed_call = parse_single_tool_call_professional(tool_call_text)
+            # 解析单个工具调用；定位时已匹配到函数名的，直接传入函数名和参数起始位置
+            call_match = call_matches[i]
+            if call_match.group(1) is not None:
+                parsed_call = parse_single_tool_call_professional(
+                    tool_call_text, call_match.group(1), call_match.end() - start_pos
+                )
+            else:
+                parsed_call = parse_single_tool_call_professional(tool_call_text)
             if parsed_call:
-                tool_calls.append(parsed_call)
+                tool_calls.append((parsed_call, start_pos, end_pos + 1))
             else:
                 errors.append(f"工具调用 {i+1} 解析失败")
                 
     except Exception as e:
-        logger.error(f"❌ 批量解析过程出错: {type(e).__name__}: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("❌ 批量解析过程出错: %s: %s", type(e).__name__, e)
     
     # 记录结果
     if tool_calls:
-        logger.info(f"🎉 成功解析 {len(tool_calls)} 个工具调用")
-        for tc in tool_calls:
-            logger.info(f"  ✓ {tc.function['name']} (ID: {tc.id})")
+        logger.info("🎉 成功解析 %d 个工具调用", len(tool_calls))
+        if logger.isEnabledFor(logging.DEBUG):
+            for tc, _, _ in tool_calls:
+                logger.debug("  ✓ %s (ID: %s)", tc.function['name'], tc.id)
     
     if errors:
         logger.warning(f"⚠️ 有 {len(errors)} 个解析失败:")
         for error in errors:
             logger.warning(f"  ✗ {error}")
     
+    return tool_calls
+
+
+def parse_bracket_tool_calls_professional(response_text: str) -> Optional[List[ToolCall]]:
+    """专业的批量工具调用解析器"""
+    tool_calls = [tc for tc, _, _ in parse_bracket_tool_calls_with_spans(response_text)]
     return tool_calls if tool_calls else None
 
 
 # 为了确保兼容性，也更新原来的函数名
 def parse_bracket_tool_calls(response_text: str) -> Optional[List[ToolCall]]:
     """向后兼容的函数名"""
+    # 常见的无工具调用响应直接返回，不进入解析器也不产生日志记录
+    if not response_text or "[Called" not in response_text:
+        return None
     return parse_bracket_tool_calls_professional(response_text)
 
 
@@ -260,32 +255,47 @@ def parse_single_tool_call(tool_call_text: str) -> Optional[ToolCall]:
     return parse_single_tool_call_professional(tool_call_text)
 
 
+def _canonical_arguments(arguments) -> str:
+    """将参数规范化为紧凑、键有序的JSON，使仅空白或键顺序不同的参数视为相同"""
+    try:
+        if isinstance(arguments, str):
+            arguments = orjson.loads(arguments)
+        return orjson.dumps(arguments, option=orjson.OPT_SORT_KEYS).decode()
+    except (TypeError, ValueError):
+        return str(arguments)
+
+
+def _as_tool_call(tool_call: Union[dict, ToolCall]) -> ToolCall:
+    """Convert to ToolCall if it's a dict"""
+    if isinstance(tool_call, dict):
+        return ToolCall(
+            id=tool_call.get("id", f"call_{secrets.token_hex(4)}"),
+            type=tool_call.get("type", "function"),
+            function=tool_call.get("function", {})
+        )
+    return tool_call
+
+
 def deduplicate_tool_calls(tool_calls: List[Union[dict, ToolCall]]) -> List[ToolCall]:
     """Deduplicate tool calls based on function name and arguments"""
-    seen = set()
-    unique_tool_calls = []
+    # 少于两个调用时不可能重复，跳过参数规范化
+    if len(tool_calls) < 2:
+        return [_as_tool_call(tool_call) for tool_call in tool_calls]
     
-    for tool_call in tool_calls:
-        # Convert to ToolCall if it's a dict
-        if isinstance(tool_call, dict):
-            tc = ToolCall(
-                id=tool_call.get("id", f"call_{uuid.uuid4().hex[:8]}"),
-                type=tool_call.get("type", "function"),
-                function=tool_call.get("function", {})
-            )
-        else:
-            tc = tool_call
-        
-        # Create unique key based on function name and arguments
-        key = (
-            tc.function.get("name", ""),
-            tc.function.get("arguments", "")
-        )
-        
-        if key not in seen:
-            seen.add(key)
-            unique_tool_calls.append(tc)
-        else:
-            logger.info(f"🔄 Skipping duplicate tool call: {tc.function.get('name', 'unknown')}")
+    # 先统一转换，再一次性生成去重键
+    tcs = [_as_tool_call(tool_call) for tool_call in tool_calls]
+    keys = [
+        (tc.function.get("name", ""), _canonical_arguments(tc.function.get("arguments", "")))
+        for tc in tcs
+    ]
+    
+    # dict 保持插入顺序，setdefault 保留每个键第一次出现的调用
+    unique_tool_calls = {}
+    for key, tc in zip(keys, tcs):
+        unique_tool_calls.setdefault(key, tc)
+    
+    duplicate_count = len(tcs) - len(unique_tool_calls)
+    if duplicate_count:
+        logger.info("🔄 Skipping %d duplicate tool call(s)", duplicate_count)
     
-    return unique_tool_calls
+    return list(unique_tool_calls.values())
@@ -3,87 +3,117 @@ import json
 import struct
 import logging
 from typing import List, Dict, Any
+import orjson
 
 logger = logging.getLogger(__name__)
 
+# AWS event-stream 帧头：总长度 + 头部长度（大端）
+_FRAME_HEADER = struct.Struct('>II')
+
+# flush 时从残留 buffer 中恢复数据所用的模式
+_FLUSH_JSON_RE = re.compile(r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}', re.DOTALL)
+_FLUSH_CONTENT_RE = re.compile(r'"content"\s*:\s*"([^"\\]*(?:\\.[^"\\]*)*)"')
+
+# SimpleResponseParser 的兜底清洗模式
+_CONTENT_JSON_RE = re.compile(r'\{[^{}]*"content"[^{}]*\}', re.DOTALL)
+# 控制字符（保留 \t \n \r）用 str.translate 按表删除，不经过正则引擎
+_CONTROL_CHARS_TABLE = dict.fromkeys([*range(0x00, 0x09), 0x0B, 0x0C, *range(0x0E, 0x20), 0x7F])
+_EVENT_TYPE_HEADER_RE = re.compile(r':event-type[^:]*:[^:]*:[^:]*:')
+_CONTENT_TYPE_HEADER_RE = re.compile(r':content-type[^:]*:[^:]*:[^:]*:')
+_NON_TEXT_RE = re.compile(r'[^\w\s\u4e00-\u9fff\u3040-\u309f\u30a0-\u30ff.,!?;:()"\'-]')
+_WS_RE = re.compile(r'\s+')
+
 
 class CodeWhispererStreamParser:
     def __init__(self):
-        self.buffer = b''
+        # bytearray 追加是均摊 O(1) 的；帧在原地按偏移解析，每次 parse 结束时才把已消费的部分整体移除
+        self.buffer = bytearray()
         self.error_count = 0
         self.max_errors = 5
 
     def parse(self, chunk: bytes) -> List[Dict[str, Any]]:
         """解析AWS事件流格式的数据块"""
-        self.buffer += chunk
-        logger.debug(f"Parser received {len(chunk)} bytes. Buffer size: {len(self.buffer)}")
+        buffer = self.buffer
+        buffer += chunk
+        logger.debug("Parser received %d bytes. Buffer size: %d", len(chunk), len(buffer))
         events = []
         
-        if len(self.buffer) < 12:
+        if len(buffer) < 12:
             return []
-            
-        while len(self.buffer) >= 12:
+        
+        pos = 0
+        while len(buffer) - pos >= 12:
             try:
-                header_bytes = self.buffer[0:8]
-                total_len, header_len = struct.unpack('>II', header_bytes)
+                total_len, header_len = _FRAME_HEADER.unpack_from(buffer, pos)
                 
-                # 安全检查
-                if total_len > 2000000 or header_len > 2000000:
+                # 安全检查：帧至少包含 12 字节前导和 4 字节 CRC，过短的长度会让游标原地不动
+                if total_len < 16 or total_len > 2000000 or header_len > 2000000:
                     logger.error(f"Unreasonable header values: total_len={total_len}, header_len={header_len}")
-                    self.buffer = self.buffer[8:]
+                    pos += 8
                     self.error_count += 1
                     if self.error_count > self.max_errors:
                         logger.error("Too many parsing errors, clearing buffer")
-                        self.buffer = b''
+                        buffer.clear()
+                        pos = 0
                     continue
 
                 # 等待完整帧
-                if len(self.buffer) < total_len:
+                if len(buffer) - pos < total_len:
                     break
 
-                # 提取完整帧
-                frame = self.buffer[:total_len]
-                self.buffer = self.buffer[total_len:]
+                # 定位完整帧，不复制
+                frame_start = pos
+                pos += total_len
 
-                # 提取有效载荷
-                payload_start = 8 + header_len
-                payload_end = total_len - 4  # 减去尾部CRC
+                # 有效载荷的位置
+                payload_start = frame_start + 8 + header_len
+                payload_end = frame_start + total_len - 4  # 减去尾部CRC
                 
-                if payload_start >= payload_end or payload_end > len(frame):
+                if payload_start >= payload_end:
                     logger.error(f"Invalid payload bounds")
                     continue
-                    
-                payload = frame[payload_start:payload_end]
                 
                 # 解码有效载荷
                 try:
-                    payload_str = payload.decode('utf-8', errors='ignore')
-                    
-                    # 尝试解析JSON
-                    json_start_index = payload_str.find('{')
+                    # '{' 不会出现在 UTF-8 多字节序列中，可以直接在字节上查找，JSON 部分直接交给 orjson
+                    # 标准帧的载荷紧跟在 4 字节前导 CRC 和头部之后，直接以 '{' 开头，此时无需查找
+                    json_start_index = payload_start + 4
+                    if json_start_index >= payload_end or buffer[json_start_index] != 0x7B:
+                        json_start_index = buffer.find(b'{', payload_start, payload_end)
                     if json_start_index != -1:
-                        json_payload = payload_str[json_start_index:]
-                        event_data = json.loads(json_payload)
+                        # 通过 memoryview 读取载荷，不复制；with 结束即释放，之后才能对 buffer 做 del/clear
+                        with memoryview(buffer)[json_start_index:payload_end] as json_payload:
+                            try:
+                                event_data = orjson.loads(json_payload)
+                            except orjson.JSONDecodeError:
+                                # orjson 要求严格的 UTF-8，回退到忽略非法字节的解码方式
+                                event_data = json.loads(str(json_payload, 'utf-8', errors='ignore'))
                         events.append(event_data)
-                        logger.debug(f"Successfully parsed event: {event_data}")
+                        logger.debug("Successfully parsed event: %s", event_data)
                 except json.JSONDecodeError as e:
                     logger.error(f"JSON decode error: {e}")
                     continue
 
             except struct.error as e:
                 logger.error(f"Struct unpack error: {e}")
-                self.buffer = self.buffer[1:]
+                pos += 1
                 self.error_count += 1
                 if self.error_count > self.max_errors:
                     logger.error("Too many parsing errors, clearing buffer")
-                    self.buffer = b''
+                    buffer.clear()
+                    pos = 0
             except Exception as e:
                 logger.error(f"Unexpected error during parsing: {str(e)}")
-                self.buffer = self.buffer[1:]
+                pos += 1
                 self.error_count += 1
                 if self.error_count > self.max_errors:
                     logger.error("Too many parsing errors, clearing buffer")
-                    self.buffer = b''
+                    buffer.clear()
+                    pos = 0
+        
+        # 移除已消费的字节，只保留不完整的帧
+        if pos:
+            del buffer[:pos]
         
         if events:
             self.error_count = 0
@@ -107,8 +137,7 @@ class CodeWhispererStreamParser:
             buffer_str = self.buffer.decode('utf-8', errors='ignore')
             
             # 方法1：查找所有 JSON 对象
-            json_pattern = r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}'
-            matches = re.findall(json_pattern, buffer_str, re.DOTALL)
+            matches = _FLUSH_JSON_RE.findall(buffer_str)
             
             for match in matches:
                 try:
@@ -121,8 +150,7 @@ class CodeWhispererStreamParser:
                     
             # 方法2：如果没找到完整JSON，尝试提取 content 字段
             if not events and '"content"' in buffer_str:
-                content_pattern = r'"content"\s*:\s*"([^"\\]*(?:\\.[^"\\]*)*)"'
-                content_matches = re.findall(content_pattern, buffer_str)
+                content_matches = _FLUSH_CONTENT_RE.findall(buffer_str)
                 for content in content_matches:
                     # 解码转义字符
                     try:
@@ -136,13 +164,18 @@ class CodeWhispererStreamParser:
             logger.error(f"Error during buffer flush: {e}")
             
         # 清空 buffer
-        self.buffer = b''
+        self.buffer.clear()
         
         if events:
             logger.info(f"✅ Flush recovered {len(events)} events from buffer")
         
         return events
     
+    def reset(self):
+        """清空解析状态，以便实例被复用"""
+        self.buffer.clear()
+        self.error_count = 0
+    
     def has_remaining_data(self) -> bool:
         """检查 buffer 中是否还有未处理的数据"""
         return len(self.buffer) > 0
@@ -152,6 +185,25 @@ class CodeWhispererStreamParser:
         return len(self.buffer)
 
 
+# 空闲解析器池：请求结束后归还，避免每个请求都重新创建解析器
+_PARSER_POOL: List[CodeWhispererStreamParser] = []
+_PARSER_POOL_MAX_SIZE = 32
+
+
+def acquire_parser() -> CodeWhispererStreamParser:
+    """从池中取出一个解析器，池为空时新建"""
+    if _PARSER_POOL:
+        return _PARSER_POOL.pop()
+    return CodeWhispererStreamParser()
+
+
+def release_parser(parser: CodeWhispererStreamParser):
+    """重置解析器并归还到池中"""
+    parser.reset()
+    if len(_PARSER_POOL) < _PARSER_POOL_MAX_SIZE:
+        _PARSER_POOL.append(parser)
+
+
 class SimpleResponseParser:
     @staticmethod
     def parse_event_stream_to_json(raw_data: bytes) -> Dict[str, Any]:
@@ -163,8 +215,7 @@ class SimpleResponseParser:
                 raw_str = str(raw_data)
             
             # Method 1: Look for JSON objects with content field
-            json_pattern = r'\{[^{}]*"content"[^{}]*\}'
-            matches = re.findall(json_pattern, raw_str, re.DOTALL)
+            matches = _CONTENT_JSON_RE.findall(raw_str)
             
             if matches:
                 content_parts = []
@@ -183,12 +234,12 @@ class SimpleResponseParser:
                     }
             
             # Method 2: Extract readable text
-            clean_text = re.sub(r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F]', '', raw_str)
-            clean_text = re.sub(r':event-type[^:]*:[^:]*:[^:]*:', '', clean_text)
-            clean_text = re.sub(r':content-type[^:]*:[^:]*:[^:]*:', '', clean_text)
+            clean_text = raw_str.translate(_CONTROL_CHARS_TABLE)
+            clean_text = _EVENT_TYPE_HEADER_RE.sub('', clean_text)
+            clean_text = _CONTENT_TYPE_HEADER_RE.sub('', clean_text)
             
-            meaningful_text = re.sub(r'[^\w\s\u4e00-\u9fff\u3040-\u309f\u30a0-\u30ff.,!?;:()"\'-]', '', clean_text)
-            meaningful_text = re.sub(r'\s+', ' ', meaningful_text).strip()
+            meaningful_text = _NON_TEXT_RE.sub('', clean_text)
+            meaningful_text = _WS_RE.sub(' ', meaningful_text).strip()
             
             if meaningful_text and len(meaningful_text) > 5:
                 return {
@@ -1,93 +1,76 @@
 import re
-import json
-import uuid
+import secrets
 import logging
 from typing import Optional, List
+import orjson
 
 from models.schemas import ToolCall
 
 logger = logging.getLogger(__name__)
 
+# 一次扫描同时匹配带参数和只有工具名的调用；<tool_use> 包裹的形式也由它覆盖
+_TOOL_CALL_RE = re.compile(
+    r'<tool_name>(?P<name>[^<]+)</tool_name>'
+    r'(?:\s*<tool_parameter_name>(?P<pname>[^<]+)</tool_parameter_name>'
+    r'\s*<tool_parameter_value>(?P<pval>[^<]*)</tool_parameter_value>)?',
+    re.DOTALL | re.IGNORECASE,
+)
+
+# 预筛选：响应中没有 <tool_name 标签（不区分大小写）时无需运行完整模式
+_TOOL_NAME_TAG_RE = re.compile(r'<tool_name', re.IGNORECASE)
+
 
 def parse_xml_tool_calls(response_text: str) -> Optional[List[ToolCall]]:
     """解析CodeWhisperer返回的XML格式工具调用，转换为OpenAI格式"""
     if not response_text:
         return None
     
-    tool_calls = []
+    # 没有 <tool_name 标签时直接返回，不复制整段响应做小写转换
+    if not _TOOL_NAME_TAG_RE.search(response_text):
+        return None
     
-    logger.info(f"🔍 开始解析XML工具调用，响应文本长度: {len(response_text)}")
+    logger.debug("🔍 开始解析XML工具调用，响应文本长度: %d", len(response_text))
     
-    # 方法1: 解析 <tool_use> 标签格式
-    tool_use_pattern = r'<tool_use>\s*<tool_name>([^<]+)</tool_name>\s*<tool_parameter_name>([^<]+)</tool_parameter_name>\s*<tool_parameter_value>([^<]*)</tool_parameter_value>\s*</tool_use>'
-    matches = re.finditer(tool_use_pattern, response_text, re.DOTALL | re.IGNORECASE)
+    param_calls = []
+    name_only_calls = []
     
-    for match in matches:
-        function_name = match.group(1).strip()
-        param_name = match.group(2).strip()
-        param_value = match.group(3).strip()
+    for match in _TOOL_CALL_RE.finditer(response_text):
+        function_name = match.group("name").strip()
+        param_name = match.group("pname")
         
-        arguments = {param_name: param_value}
-        tool_call_id = f"call_{uuid.uuid4().hex[:8]}"
-        
-        tool_call = ToolCall(
-            id=tool_call_id,
-            type="function",
-            function={
-                "name": function_name,
-                "arguments": json.dumps(arguments, ensure_ascii=False)
-            }
-        )
-        tool_calls.append(tool_call)
-        logger.info(f"✅ 解析到工具调用: {function_name} with {param_name}={param_value}")
+        if param_name is not None:
+            param_name = param_name.strip()
+            param_value = match.group("pval").strip()
+            arguments = orjson.dumps({param_name: param_value}).decode()
+            param_calls.append((function_name, arguments))
+            logger.debug("✅ 解析到工具调用: %s with %s=%s", function_name, param_name, param_value)
+        else:
+            name_only_calls.append((function_name, "{}"))
     
-    # 方法2: 解析简单的 <tool_name> 格式
-    if not tool_calls:
-        simple_pattern = r'<tool_name>([^<]+)</tool_name>\s*<tool_parameter_name>([^<]+)</tool_parameter_name>\s*<tool_parameter_value>([^<]*)</tool_parameter_value>'
-        matches = re.finditer(simple_pattern, response_text, re.DOTALL | re.IGNORECASE)
-        
-        for match in matches:
-            function_name = match.group(1).strip()
-            param_name = match.group(2).strip()
-            param_value = match.group(3).strip()
-            
-            arguments = {param_name: param_value}
-            tool_call_id = f"call_{uuid.uuid4().hex[:8]}"
-            
-            tool_call = ToolCall(
-                id=tool_call_id,
-                type="function",
-                function={
-                    "name": function_name,
-                    "arguments": json.dumps(arguments, ensure_ascii=False)
-                }
-            )
-            tool_calls.append(tool_call)
-            logger.info(f"✅ 解析到简单工具调用: {function_name} with {param_name}={param_value}")
+    # 只有在完全没有带参数的调用时，才把只有工具名的匹配当作无参数调用
+    if param_calls:
+        parsed = param_calls
+    else:
+        parsed = name_only_calls
+        if logger.isEnabledFor(logging.DEBUG):
+            for function_name, _ in parsed:
+                logger.debug("✅ 解析到无参数工具调用: %s", function_name)
     
-    # 方法3: 解析只有工具名的情况
-    if not tool_calls:
-        name_only_pattern = r'<tool_name>([^<]+)</tool_name>'
-        matches = re.finditer(name_only_pattern, response_text, re.IGNORECASE)
-        
-        for match in matches:
-            function_name = match.group(1).strip()
-            tool_call_id = f"call_{uuid.uuid4().hex[:8]}"
-            
-            tool_call = ToolCall(
-                id=tool_call_id,
-                type="function",
-                function={
-                    "name": function_name,
-                    "arguments": "{}"
-                }
-            )
-            tool_calls.append(tool_call)
-            logger.info(f"✅ 解析到无参数工具调用: {function_name}")
+    # 一次取出所有调用需要的随机字节，每个 id 占 8 个十六进制字符
+    # 字段均由本函数生成，跳过 Pydantic 校验
+    id_hex = secrets.token_hex(4 * len(parsed))
+    tool_calls = [
+        ToolCall.model_construct(
+            id=f"call_{id_hex[i * 8:i * 8 + 8]}",
+            type="function",
+            function={"name": function_name, "arguments": arguments}
+        )
+        for i, (function_name, arguments) in enumerate(parsed)
+    ]
     
     if tool_calls:
-        logger.info(f"🎉 总共解析出 {len(tool_calls)} 个工具调用")
+        logger.info("🎉 总共解析出 %d 个工具调用", len(tool_calls))
         return tool_calls
     else:
-        logger.info("❌ 未发现任何XML格式的工具调用")
+        logger.debug("❌ 未发现任何XML格式的工具调用")
         return None
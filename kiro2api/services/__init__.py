@@ -1,7 +1,9 @@
 from .request_builder import build_codewhisperer_request
+from .http_client import get_http_client, close_http_client
 from .response_handler import (
     call_kiro_api,
     estimate_tokens,
+    estimate_prompt_tokens,
     create_usage_stats,
     create_non_streaming_response,
     create_streaming_response,
@@ -11,8 +13,11 @@ from .claude_stream_handler import ClaudeStreamHandler, handle_claude_stream
 
 __all__ = [
     "build_codewhisperer_request",
+    "get_http_client",
+    "close_http_client",
     "call_kiro_api",
     "estimate_tokens",
+    "estimate_prompt_tokens",
     "create_usage_stats",
     "create_non_streaming_response",
     "create_streaming_response",
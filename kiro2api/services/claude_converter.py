@@ -7,13 +7,13 @@ Claude API 请求转换器
 import re
 import json
 import uuid
-import copy
 import base64
 import logging
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any
 
 from config import MODEL_MAP, DEFAULT_MODEL, PROFILE_ARN
-from models.claude_schemas import ClaudeRequest, ClaudeMessage
+from models.claude_schemas import ClaudeRequest
+from services.request_builder import log_codewhisperer_request
 
 logger = logging.getLogger(__name__)
 
@@ -305,18 +305,19 @@ def convert_claude_to_codewhisperer_request(request: ClaudeRequest) -> Dict[str,
     if system_prompt:
         current_content = f"{system_prompt}\n\n{current_content}"
     
-    # 构建请求 - 与 OpenAI 格式完全一致
+    # 构建请求 - 与 OpenAI 格式完全一致（保留 userInputMessage 的引用，后面直接追加字段）
+    user_input_message = {
+        "content": current_content,
+        "modelId": codewhisperer_model,
+        "origin": "AI_EDITOR"
+    }
     codewhisperer_request = {
         "profileArn": PROFILE_ARN,
         "conversationState": {
             "chatTriggerType": "MANUAL",
             "conversationId": conversation_id,
             "currentMessage": {
-                "userInputMessage": {
-                    "content": current_content,
-                    "modelId": codewhisperer_model,
-                    "origin": "AI_EDITOR"
-                }
+                "userInputMessage": user_input_message
             },
             "history": history
         }
@@ -337,7 +338,7 @@ def convert_claude_to_codewhisperer_request(request: ClaudeRequest) -> Dict[str,
     
     # 添加图片 - 与 OpenAI 格式一致
     if images:
-        codewhisperer_request["conversationState"]["currentMessage"]["userInputMessage"]["images"] = images
+        user_input_message["images"] = images
         logger.info(f"📊 添加了 {len(images)} 个图片到 userInputMessage 中")
         for idx, img in enumerate(images):
             logger.info(f"  - 图片 {idx+1}: 格式={img['format']}, 大小={len(img['source']['bytes'])} 字符")
@@ -345,15 +346,9 @@ def convert_claude_to_codewhisperer_request(request: ClaudeRequest) -> Dict[str,
         logger.info(f"✅ 成功添加 images 到 userInputMessage 中")
     
     if user_input_message_context:
-        codewhisperer_request["conversationState"]["currentMessage"]["userInputMessage"]["userInputMessageContext"] = user_input_message_context
+        user_input_message["userInputMessageContext"] = user_input_message_context
         logger.info(f"✅ 成功添加 userInputMessageContext 到请求中")
     
-    # 创建日志请求副本
-    log_request = copy.deepcopy(codewhisperer_request)
-    if "images" in log_request.get("conversationState", {}).get("currentMessage", {}).get("userInputMessage", {}):
-        for img in log_request["conversationState"]["currentMessage"]["userInputMessage"]["images"]:
-            if "bytes" in img.get("source", {}):
-                img["source"]["bytes"] = img["source"]["bytes"][:20] + "..."
-    
-    logger.info(f"🔄 COMPLETE CODEWHISPERER REQUEST: {json.dumps(log_request, indent=2)}")
+    # 完整请求只在 DEBUG 级别记录
+    log_codewhisperer_request(logger, codewhisperer_request)
     return codewhisperer_request
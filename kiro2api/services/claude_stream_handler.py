@@ -8,24 +8,28 @@ import json
 import uuid
 import logging
 from typing import List, Dict, Any, Optional, Generator, AsyncGenerator
+import orjson
 
-from parsers.stream_parser import CodeWhispererStreamParser
+from parsers.stream_parser import acquire_parser, release_parser
 from models.claude_schemas import ClaudeRequest
 
 logger = logging.getLogger(__name__)
 
 
-def build_claude_sse_event(event_type: str, data: Dict[str, Any]) -> str:
+# SSE 事件帧模板，orjson 输出的字节直接填入，不再解码成 str 再由 ASGI 重新编码
+_SSE_EVENT_FMT = b"event: %s\ndata: %s\n\n"
+
+
+def build_claude_sse_event(event_type: str, data: Dict[str, Any]) -> bytes:
     """构建 Claude SSE 格式的事件"""
-    json_data = json.dumps(data)
-    return f"event: {event_type}\ndata: {json_data}\n\n"
+    return _SSE_EVENT_FMT % (event_type.encode(), orjson.dumps(data))
 
 
 def build_claude_message_start_event(
     conversation_id: str,
     model: str = "claude-sonnet-4.5",
     input_tokens: int = 0
-) -> str:
+) -> bytes:
     """构建 message_start 事件"""
     data = {
         "type": "message_start",
@@ -43,7 +47,7 @@ def build_claude_message_start_event(
     return build_claude_sse_event("message_start", data)
 
 
-def build_claude_content_block_start_event(index: int) -> str:
+def build_claude_content_block_start_event(index: int) -> bytes:
     """构建 content_block_start 事件（文本类型）"""
     data = {
         "type": "content_block_start",
@@ -53,7 +57,7 @@ def build_claude_content_block_start_event(index: int) -> str:
     return build_claude_sse_event("content_block_start", data)
 
 
-def build_claude_content_block_delta_event(index: int, text: str) -> str:
+def build_claude_content_block_delta_event(index: int, text: str) -> bytes:
     """构建 content_block_delta 事件"""
     data = {
         "type": "content_block_delta",
@@ -63,7 +67,7 @@ def build_claude_content_block_delta_event(index: int, text: str) -> str:
     return build_claude_sse_event("content_block_delta", data)
 
 
-def build_claude_content_block_stop_event(index: int) -> str:
+def build_claude_content_block_stop_event(index: int) -> bytes:
     """构建 content_block_stop 事件"""
     data = {
         "type": "content_block_stop",
@@ -72,7 +76,7 @@ def build_claude_content_block_stop_event(index: int) -> str:
     return build_claude_sse_event("content_block_stop", data)
 
 
-def build_claude_ping_event() -> str:
+def build_claude_ping_event() -> bytes:
     """构建 ping 事件"""
     data = {"type": "ping"}
     return build_claude_sse_event("ping", data)
@@ -82,7 +86,7 @@ def build_claude_message_stop_event(
     input_tokens: int,
     output_tokens: int,
     stop_reason: str = "end_turn"
-) -> str:
+) -> bytes:
     """构建 message_delta 和 message_stop 事件"""
     # 先发送 message_delta
     delta_data = {
@@ -103,7 +107,7 @@ def build_claude_message_stop_event(
     return delta_event + stop_event
 
 
-def build_claude_tool_use_start_event(index: int, tool_use_id: str, tool_name: str) -> str:
+def build_claude_tool_use_start_event(index: int, tool_use_id: str, tool_name: str) -> bytes:
     """构建 tool use 类型的 content_block_start 事件"""
     data = {
         "type": "content_block_start",
@@ -117,7 +121,7 @@ def build_claude_tool_use_start_event(index: int, tool_use_id: str, tool_name: s
     return build_claude_sse_event("content_block_start", data)
 
 
-def build_claude_tool_use_input_delta_event(index: int, input_json_delta: str) -> str:
+def build_claude_tool_use_input_delta_event(index: int, input_json_delta: str) -> bytes:
     """构建 tool use input 内容的 content_block_delta 事件"""
     data = {
         "type": "content_block_delta",
@@ -130,6 +134,15 @@ def build_claude_tool_use_input_delta_event(index: int, input_json_delta: str) -
     return build_claude_sse_event("content_block_delta", data)
 
 
+def build_claude_error_event(error_type: str, message: str) -> bytes:
+    """构建 error 事件（message 由 orjson 转义，可安全包含引号等字符）"""
+    data = {
+        "type": "error",
+        "error": {"type": error_type, "message": message}
+    }
+    return build_claude_sse_event("error", data)
+
+
 def count_tokens(text: str) -> int:
     """计算文本的 token 数量（简化估算）"""
     if not text:
@@ -196,7 +209,8 @@ class ClaudeStreamHandler:
     
     def __init__(self, model: str = "claude-sonnet-4.5", request_data: Optional[ClaudeRequest] = None):
         self.model = model
-        self.parser = CodeWhispererStreamParser()
+        # 解析器从池中借用，流结束后由 close() 归还
+        self.parser = acquire_parser()
         
         # 响应文本累积缓冲区
         self.response_buffer: List[str] = []
@@ -230,14 +244,14 @@ class ClaudeStreamHandler:
         else:
             self.input_tokens = 0
     
-    def handle_chunk(self, chunk: bytes) -> Generator[str, None, None]:
+    def handle_chunk(self, chunk: bytes) -> Generator[bytes, None, None]:
         """处理数据块并返回 Claude 格式的事件"""
         messages = self.parser.parse(chunk)
         
         for message in messages:
             yield from self._process_event(message)
     
-    def _process_event(self, event: Dict[str, Any]) -> Generator[str, None, None]:
+    def _process_event(self, event: Dict[str, Any]) -> Generator[bytes, None, None]:
         """处理单个事件"""
         # 检测事件类型
         if "conversationId" in event:
@@ -288,7 +302,7 @@ class ClaudeStreamHandler:
             # toolUseEvent 事件
             yield from self._handle_tool_use_event(event)
     
-    def _handle_tool_use_event(self, event: Dict[str, Any]) -> Generator[str, None, None]:
+    def _handle_tool_use_event(self, event: Dict[str, Any]) -> Generator[bytes, None, None]:
         """处理 tool use 事件"""
         tool_use_id = event.get("toolUseId")
         tool_name = event.get("name")
@@ -324,7 +338,7 @@ class ClaudeStreamHandler:
             if isinstance(tool_input, str):
                 input_fragment = tool_input
             elif isinstance(tool_input, dict):
-                input_fragment = json.dumps(tool_input)
+                input_fragment = orjson.dumps(tool_input).decode()
             else:
                 input_fragment = str(tool_input)
             
@@ -348,7 +362,7 @@ class ClaudeStreamHandler:
             self.current_tool_use = None
             self.tool_input_buffer = []
     
-    def finalize(self) -> Generator[str, None, None]:
+    def finalize(self) -> Generator[bytes, None, None]:
         """流结束时的收尾处理"""
         # 只有当 content_block_started 且尚未发送 content_block_stop 时才发送
         if self.content_block_started and not self.content_block_stop_sent:
@@ -366,24 +380,33 @@ class ClaudeStreamHandler:
         )
         
         yield build_claude_message_stop_event(self.input_tokens, output_tokens, "end_turn")
+    
+    def close(self):
+        """归还解析器（连同其缓冲区）到池中；重复调用是安全的"""
+        if self.parser is not None:
+            release_parser(self.parser)
+            self.parser = None
 
 
 async def handle_claude_stream(
     response_body: bytes,
     model: str = "claude-sonnet-4.5",
     request_data: Optional[ClaudeRequest] = None
-) -> AsyncGenerator[str, None]:
+) -> AsyncGenerator[bytes, None]:
     """
     处理 CodeWhisperer 响应并生成 Claude 格式的 SSE 事件
     用于非流式响应的处理
     """
     handler = ClaudeStreamHandler(model, request_data)
     
-    # 处理响应体
-    for event in handler.handle_chunk(response_body):
-        yield event
-    
-    # 发送收尾事件
-    for event in handler.finalize():
-        yield event
+    try:
+        # 处理响应体
+        for event in handler.handle_chunk(response_body):
+            yield event
+        
+        # 发送收尾事件
+        for event in handler.finalize():
+            yield event
+    finally:
+        handler.close()
 
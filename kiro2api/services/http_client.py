@@ -0,0 +1,36 @@
+"""
+上游 Kiro/CodeWhisperer API 共享的 HTTP 客户端
+所有请求复用同一个连接池，避免每个请求重新建立 TCP/TLS 连接
+"""
+
+import logging
+from typing import Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# 分离连接超时和读取超时：流式响应不限制读取时间，避免长对话被截断
+UPSTREAM_TIMEOUT = httpx.Timeout(connect=30.0, read=None, write=30.0, pool=30.0)
+
+# 流式连接会长时间占用，不限制总连接数（与之前每个请求独立建连的行为一致），只限制空闲保活的数量
+UPSTREAM_LIMITS = httpx.Limits(max_connections=None, max_keepalive_connections=32)
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """获取共享的上游 HTTP 客户端，首次使用时创建"""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(timeout=UPSTREAM_TIMEOUT, limits=UPSTREAM_LIMITS)
+    return _client
+
+
+async def close_http_client():
+    """关闭共享的上游 HTTP 客户端（应用关闭时调用）"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+        logger.info("上游 HTTP 客户端已关闭")
@@ -1,9 +1,8 @@
 import re
-import json
 import uuid
-import copy
 import base64
 import logging
+import orjson
 from fastapi import HTTPException
 
 from config import MODEL_MAP, DEFAULT_MODEL, PROFILE_ARN
@@ -11,6 +10,45 @@ from models.schemas import ChatCompletionRequest
 
 logger = logging.getLogger(__name__)
 
+# 从 data URI 头部（如 "data:image/jpeg;base64"）提取图片格式
+_DATA_URI_FMT_RE = re.compile(r'image/(\w+)')
+
+# Base64 只校验前缀：长度为 4 的倍数，避免为校验而解码整张图片
+_BASE64_PROBE_LEN = 64
+# Base64 数据中允许出现的换行等空白（与宽松解码一致，校验时忽略）
+_BASE64_WS_RE = re.compile(r'\s+')
+
+def _append_history_pair(history: list, user_content: str, assistant_content: str, user_frame: dict):
+    """向 history 追加一组 用户/助手 消息；user_frame 为本次请求固定的 modelId/origin 字段"""
+    history.append({"userInputMessage": {"content": user_content, **user_frame}})
+    history.append({"assistantResponseMessage": {"content": assistant_content}})
+
+
+def log_codewhisperer_request(log: logging.Logger, codewhisperer_request: dict):
+    """在 DEBUG 级别记录完整的 CodeWhisperer 请求
+
+    图片数据只保留前20个字符，沿路径浅拷贝，不 deepcopy 整个请求；未开启 DEBUG 时不做任何处理。
+    """
+    if not log.isEnabledFor(logging.DEBUG):
+        return
+    log_request = codewhisperer_request
+    conversation_state = codewhisperer_request["conversationState"]
+    user_input_message = conversation_state["currentMessage"]["userInputMessage"]
+    images = user_input_message.get("images")
+    if images:
+        log_images = [
+            {**img, "source": {"bytes": img["source"]["bytes"][:20] + "..."}}
+            for img in images
+        ]
+        log_request = {
+            **codewhisperer_request,
+            "conversationState": {
+                **conversation_state,
+                "currentMessage": {"userInputMessage": {**user_input_message, "images": log_images}}
+            }
+        }
+    log.debug("🔄 COMPLETE CODEWHISPERER REQUEST: %s", orjson.dumps(log_request, option=orjson.OPT_INDENT_2).decode())
+
 
 def build_codewhisperer_request(request: ChatCompletionRequest):
     logger.info(f"🔄 request model: {request.model}")
@@ -46,101 +84,67 @@ def build_codewhisperer_request(request: ChatCompletionRequest):
     # Process history messages (all except the last one)
     if len(conversation_messages) > 1:
         history_messages = conversation_messages[:-1]
+        # 每条历史用户消息共用的固定字段，只构建一次
+        user_frame = {"modelId": codewhisperer_model, "origin": "AI_EDITOR"}
         
-        # Build user messages list (combining tool results with user messages)
-        processed_messages = []
+        # 单次遍历直接生成 history：pending_user 保存尚未配对的用户消息（工具结果会合并进去）
+        pending_user = None
         i = 0
         while i < len(history_messages):
             msg = history_messages[i]
             
             if msg.role == "user":
                 content = msg.get_content_text() or "Continue"
-                processed_messages.append(("user", content))
+                if pending_user is not None:
+                    # 上一条用户消息没有助手回复，补占位
+                    _append_history_pair(history, pending_user, "I understand.", user_frame)
+                pending_user = content
                 i += 1
             elif msg.role == "assistant":
                 # Check if this assistant message contains tool calls
-                if hasattr(msg, 'tool_calls') and msg.tool_calls:
+                if msg.tool_calls:
                     # Build a description of the tool calls
                     tool_descriptions = []
                     for tc in msg.tool_calls:
-                        func_name = tc.function.get("name", "unknown") if isinstance(tc.function, dict) else "unknown"
-                        args = tc.function.get("arguments", "{}") if isinstance(tc.function, dict) else "{}"
+                        function = tc.function if isinstance(tc.function, dict) else {}
+                        func_name = function.get("name", "unknown")
+                        args = function.get("arguments", "{}")
                         tool_descriptions.append(f"[Called {func_name} with args: {args}]")
                     content = " ".join(tool_descriptions)
-                    logger.info(f"📌 Processing assistant message with tool calls: {content}")
+                    logger.info("📌 Processing assistant message with tool calls: %s", content)
                 else:
                     content = msg.get_content_text() or "I understand."
-                processed_messages.append(("assistant", content))
+                # Orphaned assistant message 使用 "Continue" 作为用户侧
+                user_content = pending_user if pending_user is not None else "Continue"
+                _append_history_pair(history, user_content, content, user_frame)
+                pending_user = None
                 i += 1
             elif msg.role == "tool":
                 # Combine tool results into the next user message
                 tool_content = msg.get_content_text() or "[Tool executed]"
-                tool_call_id = getattr(msg, 'tool_call_id', 'unknown')
+                tool_call_id = msg.tool_call_id or 'unknown'
                 
                 # Format tool result with ID for tracking
                 formatted_tool_result = f"[Tool result for {tool_call_id}]: {tool_content}"
                 
+                if pending_user is not None:
+                    _append_history_pair(history, pending_user, "I understand.", user_frame)
+                
                 # Look ahead to see if there's a user message
                 if i + 1 < len(history_messages) and history_messages[i + 1].role == "user":
                     user_content = history_messages[i + 1].get_content_text() or ""
-                    combined_content = f"{formatted_tool_result}\n{user_content}".strip()
-                    processed_messages.append(("user", combined_content))
+                    pending_user = f"{formatted_tool_result}\n{user_content}".strip()
                     i += 2
                 else:
                     # Tool result without following user message - add as user message
-                    processed_messages.append(("user", formatted_tool_result))
+                    pending_user = formatted_tool_result
                     i += 1
             else:
                 i += 1
         
-        # Build history pairs
-        i = 0
-        while i < len(processed_messages):
-            role, content = processed_messages[i]
-            
-            if role == "user":
-                history.append({
-                    "userInputMessage": {
-                        "content": content,
-                        "modelId": codewhisperer_model,
-                        "origin": "AI_EDITOR"
-                    }
-                })
-                
-                # Look for assistant response
-                if i + 1 < len(processed_messages) and processed_messages[i + 1][0] == "assistant":
-                    _, assistant_content = processed_messages[i + 1]
-                    history.append({
-                        "assistantResponseMessage": {
-                            "content": assistant_content
-                        }
-                    })
-                    i += 2
-                else:
-                    # No assistant response, add a placeholder
-                    history.append({
-                        "assistantResponseMessage": {
-                            "content": "I understand."
-                        }
-                    })
-                    i += 1
-            elif role == "assistant":
-                # Orphaned assistant message
-                history.append({
-                    "userInputMessage": {
-                        "content": "Continue",
-                        "modelId": codewhisperer_model,
-                        "origin": "AI_EDITOR"
-                    }
-                })
-                history.append({
-                    "assistantResponseMessage": {
-                        "content": content
-                    }
-                })
-                i += 1
-            else:
-                i += 1
+        # 末尾仍未配对的用户消息，补占位回复
+        if pending_user is not None:
+            _append_history_pair(history, pending_user, "I understand.", user_frame)
     
     # Build current message
     current_message = conversation_messages[-1]
@@ -152,7 +156,7 @@ def build_codewhisperer_request(request: ChatCompletionRequest):
             if part.type == "image_url" and part.image_url:
                 try:
                     # 记录原始 URL 的前 50 个字符，用于调试
-                    logger.info(f"🔍 处理图片 URL: {part.image_url.url[:50]}...")
+                    logger.info("🔍 处理图片 URL: %s...", part.image_url.url[:50])
                     
                     # 检查 URL 格式是否正确
                     if not part.image_url.url.startswith("data:image/"):
@@ -166,12 +170,17 @@ def build_codewhisperer_request(request: ChatCompletionRequest):
                     # Correctly parse the image format from the mime type
                     # "data:image/jpeg;base64" -> "jpeg"
                     # Use regex to reliably extract image format, e.g., "jpeg" from "data:image/jpeg;base64"
-                    match = re.search(r'image/(\w+)', header)
+                    match = _DATA_URI_FMT_RE.search(header)
                     if match:
                         image_format = match.group(1)
-                        # 验证 Base64 编码是否有效
+                        # 验证 Base64 编码是否有效（去掉空白后检查总长度和前缀，图片数据原样透传）
                         try:
-                            base64.b64decode(encoded_data)
+                            b64_data = encoded_data
+                            if _BASE64_WS_RE.search(b64_data):
+                                b64_data = _BASE64_WS_RE.sub("", b64_data)
+                            if len(b64_data) % 4:
+                                raise ValueError("Incorrect padding")
+                            base64.b64decode(b64_data[:_BASE64_PROBE_LEN], validate=True)
                             logger.info("✅ Base64 编码验证通过")
                         except Exception as e:
                             logger.error(f"❌ Base64 编码无效: {e}")
@@ -187,28 +196,26 @@ def build_codewhisperer_request(request: ChatCompletionRequest):
                 except Exception as e:
                     logger.error(f"❌ 处理图片 URL 失败: {str(e)}")
 
-    current_content = current_message.get_content_text()
-    
     # Handle different roles for current message
     if current_message.role == "tool":
         # For tool results, format them properly and mark as completed
-        tool_result = current_content or '[Tool executed]'
-        tool_call_id = getattr(current_message, 'tool_call_id', 'unknown')
+        tool_result = current_message.get_content_text() or '[Tool executed]'
+        tool_call_id = current_message.tool_call_id or 'unknown'
         current_content = f"[Tool execution completed for {tool_call_id}]: {tool_result}"
         
         # Check if this tool result follows a tool call in history
         if len(conversation_messages) > 1:
             prev_message = conversation_messages[-2]
-            if prev_message.role == "assistant" and hasattr(prev_message, 'tool_calls') and prev_message.tool_calls:
-                # Find the corresponding tool call
-                for tc in prev_message.tool_calls:
-                    if tc.id == tool_call_id:
-                        func_name = tc.function.get("name", "unknown") if isinstance(tc.function, dict) else "unknown"
-                        current_content = f"[Completed execution of {func_name}]: {tool_result}"
-                        break
+            if prev_message.role == "assistant" and prev_message.tool_calls:
+                # Find the corresponding tool call（倒序建表，id 重复时与原先一样取第一个）
+                tc_index = {tc.id: tc for tc in reversed(prev_message.tool_calls)}
+                tc = tc_index.get(tool_call_id)
+                if tc is not None:
+                    func_name = tc.function.get("name", "unknown") if isinstance(tc.function, dict) else "unknown"
+                    current_content = f"[Completed execution of {func_name}]: {tool_result}"
     elif current_message.role == "assistant":
         # If last message is from assistant with tool calls, format it appropriately
-        if hasattr(current_message, 'tool_calls') and current_message.tool_calls:
+        if current_message.tool_calls:
             tool_descriptions = []
             for tc in current_message.tool_calls:
                 func_name = tc.function.get("name", "unknown") if isinstance(tc.function, dict) else "unknown"
@@ -216,6 +223,8 @@ def build_codewhisperer_request(request: ChatCompletionRequest):
             current_content = "; ".join(tool_descriptions)
         else:
             current_content = "Continue the conversation"
+    else:
+        current_content = current_message.get_content_text()
     
     # Ensure current message has content
     if not current_content:
@@ -225,18 +234,19 @@ def build_codewhisperer_request(request: ChatCompletionRequest):
     if system_prompt:
         current_content = f"{system_prompt}\n\n{current_content}"
     
-    # Build request
+    # Build request（保留 userInputMessage 的引用，后面追加 images/上下文时不必逐层查找）
+    user_input_message = {
+        "content": current_content,
+        "modelId": codewhisperer_model,
+        "origin": "AI_EDITOR"
+    }
     codewhisperer_request = {
         "profileArn": PROFILE_ARN,
         "conversationState": {
             "chatTriggerType": "MANUAL",
             "conversationId": conversation_id,
             "currentMessage": {
-                "userInputMessage": {
-                    "content": current_content,
-                    "modelId": codewhisperer_model,
-                    "origin": "AI_EDITOR"
-                }
+                "userInputMessage": user_input_message
             },
             "history": history
         }
@@ -258,25 +268,19 @@ def build_codewhisperer_request(request: ChatCompletionRequest):
     # 根据文档，images 应该是 userInputMessage 的直接子字段，而不是在 userInputMessageContext 中
     if images:
         # 直接添加到 userInputMessage 中
-        codewhisperer_request["conversationState"]["currentMessage"]["userInputMessage"]["images"] = images
-        logger.info(f"📊 添加了 {len(images)} 个图片到 userInputMessage 中")
-        for i, img in enumerate(images):
-            logger.info(f"  - 图片 {i+1}: 格式={img['format']}, 大小={len(img['source']['bytes'])} 字符")
-            # 记录图片数据的前20个字符，用于调试
-            logger.info(f"  - 图片数据前20字符: {img['source']['bytes'][:20]}...")
+        user_input_message["images"] = images
+        logger.info("📊 添加了 %d 个图片到 userInputMessage 中", len(images))
+        if logger.isEnabledFor(logging.INFO):
+            for i, img in enumerate(images):
+                logger.info("  - 图片 %d: 格式=%s, 大小=%d 字符", i + 1, img['format'], len(img['source']['bytes']))
+                # 记录图片数据的前20个字符，用于调试
+                logger.info("  - 图片数据前20字符: %s...", img['source']['bytes'][:20])
         logger.info(f"✅ 成功添加 images 到 userInputMessage 中")
 
     if user_input_message_context:
-        codewhisperer_request["conversationState"]["currentMessage"]["userInputMessage"]["userInputMessageContext"] = user_input_message_context
+        user_input_message["userInputMessageContext"] = user_input_message_context
         logger.info(f"✅ 成功添加 userInputMessageContext 到请求中")
     
-    # 创建一个用于日志记录的请求副本，避免记录完整的图片数据
-    log_request = copy.deepcopy(codewhisperer_request)
-    # 检查 images 是否在 userInputMessage 中
-    if "images" in log_request.get("conversationState", {}).get("currentMessage", {}).get("userInputMessage", {}):
-        for img in log_request["conversationState"]["currentMessage"]["userInputMessage"]["images"]:
-            if "bytes" in img.get("source", {}):
-                img["source"]["bytes"] = img["source"]["bytes"][:20] + "..." # 只记录前20个字符
-    
-    logger.info(f"🔄 COMPLETE CODEWHISPERER REQUEST: {json.dumps(log_request, indent=2)}")
+    # 完整请求只在 DEBUG 级别记录
+    log_codewhisperer_request(logger, codewhisperer_request)
     return codewhisperer_request
@@ -1,44 +1,69 @@
 import re
-import json
 import time
+import asyncio
 import uuid
 import logging
 import httpx
+import orjson
+from contextlib import asynccontextmanager, suppress
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
 from fastapi import HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 
 from config import KIRO_BASE_URL
 from models.schemas import (
     ChatCompletionRequest,
+    ChatMessage,
     ChatCompletionResponse,
-    ChatCompletionStreamResponse,
     ResponseMessage,
     Choice,
-    StreamChoice,
     Usage,
     ToolCall,
 )
 from auth import token_manager
-from parsers.stream_parser import CodeWhispererStreamParser
+from parsers.stream_parser import acquire_parser, release_parser
 from parsers.bracket_parser import (
     parse_bracket_tool_calls,
+    parse_bracket_tool_calls_with_spans,
     parse_single_tool_call,
     find_matching_bracket,
+    scan_matching_bracket,
     deduplicate_tool_calls,
 )
 from services.request_builder import build_codewhisperer_request
+from services.http_client import get_http_client
 
 logger = logging.getLogger(__name__)
 
+# 移除工具调用文本后用于折叠空白
+_WS_RE = re.compile(r'\s+')
+
+# SSE 帧的固定部分，直接以 bytes 输出，StreamingResponse 无需再编码
+_SSE_PREFIX = b"data: "
+_SSE_SUFFIX = b"\n\n"
+_SSE_DONE = b"data: [DONE]\n\n"
+
+# 流式增量的合并写出阈值：累积字节数或距上次写出的时间（秒），任一达到即写出
+_STREAM_FLUSH_BYTES = 4096
+_STREAM_FLUSH_INTERVAL = 0.015
+
 
 def estimate_tokens(text: str) -> int:
     """Rough token estimation"""
     return max(1, len(text) // 4)
 
 
-def create_usage_stats(prompt_text: str, completion_text: str) -> Usage:
+def estimate_prompt_tokens(messages: List[ChatMessage]) -> int:
+    """Rough token estimation of the space-joined message texts, without building the joined string"""
+    length = sum(len(msg.get_content_text()) for msg in messages) + max(0, len(messages) - 1)
+    return max(1, length // 4)
+
+
+def create_usage_stats(prompt_text: str, completion_text: str, prompt_tokens: Optional[int] = None) -> Usage:
     """Create usage statistics"""
-    prompt_tokens = estimate_tokens(prompt_text)
+    if prompt_tokens is None:
+        prompt_tokens = estimate_tokens(prompt_text)
     completion_tokens = estimate_tokens(completion_text)
     return Usage(
         prompt_tokens=prompt_tokens,
@@ -47,6 +72,13 @@ def create_usage_stats(prompt_text: str, completion_text: str) -> Usage:
     )
 
 
+def _sse_error(message: str, error_type: str) -> bytes:
+    """构建 SSE 错误帧"""
+    payload = orjson.dumps({"error": {"message": message, "type": error_type}})
+    return _SSE_PREFIX + payload + _SSE_SUFFIX
+
+
+@asynccontextmanager
 async def call_kiro_api(request: ChatCompletionRequest):
     """
     Make API call to Kiro/CodeWhisperer with multi-account token rotation
@@ -56,6 +88,9 @@ async def call_kiro_api(request: ChatCompletionRequest):
     - 自动刷新过期 token
     - 429 错误时自动切换账号
     - 403 错误时刷新 token 并重试
+    
+    以异步上下文管理器的形式返回尚未读取响应体的 response，
+    调用方通过 response.aiter_bytes() 边收边解析。
     """
     # 使用多账号 token 管理器获取 token
     token = await token_manager.get_token()
@@ -80,76 +115,96 @@ async def call_kiro_api(request: ChatCompletionRequest):
         "Accept": "text/event-stream" if request.stream else "application/json"
     }
 
+    response = await _send_kiro_request(get_http_client(), request_data, headers)
+    try:
+        yield response
+    finally:
+        await response.aclose()
+
+
+async def _send_kiro_request(client: httpx.AsyncClient, request_data: dict, headers: dict) -> httpx.Response:
+    """发送请求并处理 403/429 重试，返回以流模式打开的成功响应"""
     # 最大重试次数（用于轮询多个账号）
     max_retries = 3
+    # 请求体只用 orjson 序列化一次，各次重试复用同一份 bytes（headers 已声明 Content-Type）
+    body = orjson.dumps(request_data)
     
     try:
-        async with httpx.AsyncClient() as client:
-            for attempt in range(max_retries):
-                response = await client.post(
+        for attempt in range(max_retries):
+            response = await client.send(
+                client.build_request(
+                    "POST",
                     KIRO_BASE_URL,
                     headers=headers,
-                    json=request_data,
+                    content=body,
                     timeout=120
-                )
-                
-                logger.info(f"📤 RESPONSE STATUS: {response.status_code} (attempt {attempt + 1})")
-                
-                if response.status_code == 403:
-                    logger.info("收到403响应，尝试刷新token...")
-                    new_token = await token_manager.refresh_tokens()
-                    if new_token:
-                        headers["Authorization"] = f"Bearer {new_token}"
-                        continue  # 使用新 token 重试
-                    else:
-                        # 刷新失败，尝试切换到下一个账号
-                        token_manager.mark_token_error()
-                        new_token = await token_manager.get_token()
-                        if new_token:
-                            headers["Authorization"] = f"Bearer {new_token}"
-                            continue
-                        raise HTTPException(status_code=401, detail="Token refresh failed and no backup accounts available")
-                
-                if response.status_code == 429:
-                    logger.warning("收到429响应（速率限制），尝试切换账号...")
-                    # 标记当前 token 已耗尽，切换到下一个账号
-                    token_manager.mark_token_exhausted("rate_limit_429")
-                    
-                    # 尝试获取新 token
+                ),
+                stream=True
+            )
+            
+            logger.info(f"📤 RESPONSE STATUS: {response.status_code} (attempt {attempt + 1})")
+            
+            if response.status_code == 403:
+                await response.aclose()
+                logger.info("收到403响应，尝试刷新token...")
+                new_token = await token_manager.refresh_tokens()
+                if new_token:
+                    headers["Authorization"] = f"Bearer {new_token}"
+                    continue  # 使用新 token 重试
+                else:
+                    # 刷新失败，尝试切换到下一个账号
+                    token_manager.mark_token_error()
                     new_token = await token_manager.get_token()
-                    if new_token and attempt < max_retries - 1:
+                    if new_token:
                         headers["Authorization"] = f"Bearer {new_token}"
-                        logger.info("已切换到新账号，重试请求...")
                         continue
-                    
-                    # 所有账号都耗尽
-                    raise HTTPException(
-                        status_code=429,
-                        detail={
-                            "error": {
-                                "message": "All accounts rate limited. Please try again later.",
-                                "type": "rate_limit_error",
-                                "param": None,
-                                "code": "rate_limit_exceeded"
-                            }
-                        }
-                    )
-                
-                response.raise_for_status()
-                return response
+                    raise HTTPException(status_code=401, detail="Token refresh failed and no backup accounts available")
             
-            # 所有重试都失败
-            raise HTTPException(
-                status_code=503,
-                detail={
-                    "error": {
-                        "message": "API call failed after multiple retries",
-                        "type": "api_error",
-                        "param": None,
-                        "code": "api_error"
+            if response.status_code == 429:
+                await response.aclose()
+                logger.warning("收到429响应（速率限制），尝试切换账号...")
+                # 标记当前 token 已耗尽，切换到下一个账号
+                token_manager.mark_token_exhausted("rate_limit_429")
+                
+                # 尝试获取新 token
+                new_token = await token_manager.get_token()
+                if new_token and attempt < max_retries - 1:
+                    headers["Authorization"] = f"Bearer {new_token}"
+                    logger.info("已切换到新账号，重试请求...")
+                    continue
+                
+                # 所有账号都耗尽
+                raise HTTPException(
+                    status_code=429,
+                    detail={
+                        "error": {
+                            "message": "All accounts rate limited. Please try again later.",
+                            "type": "rate_limit_error",
+                            "param": None,
+                            "code": "rate_limit_exceeded"
+                        }
                     }
+                )
+            
+            if response.is_error:
+                # 读取错误响应体，便于记录日志
+                await response.aread()
+                await response.aclose()
+            response.raise_for_status()
+            return response
+        
+        # 所有重试都失败
+        raise HTTPException(
+            status_code=503,
+            detail={
+                "error": {
+                    "message": "API call failed after multiple retries",
+                    "type": "api_error",
+                    "param": None,
+                    "code": "api_error"
                 }
-            )
+            }
+        )
             
     except httpx.HTTPStatusError as e:
         logger.error(f"HTTP ERROR: {e.response.status_code} - {e.response.text}")
@@ -193,49 +248,73 @@ async def create_non_streaming_response(request: ChatCompletionRequest):
     """
     try:
         logger.info("🚀 开始非流式响应生成...")
-        response = await call_kiro_api(request)
+        # 边接收边解析事件流，原始数据块仅按引用保留，用于后续的 bracket 检测
+        raw_chunks = []
+        events = []
+        async with call_kiro_api(request) as response:
+            # 添加详细的原始响应日志
+            logger.info("📤 CodeWhisperer响应状态码: %s", response.status_code)
+            if logger.isEnabledFor(logging.INFO):
+                logger.info("📤 响应头: %s", dict(response.headers))
+            
+            parser = acquire_parser()
+            try:
+                async for chunk in response.aiter_bytes():
+                    raw_chunks.append(chunk)
+                    events.extend(parser.parse(chunk))
+            finally:
+                release_parser(parser)
         
-        # 添加详细的原始响应日志
-        logger.info(f"📤 CodeWhisperer响应状态码: {response.status_code}")
-        logger.info(f"📤 响应头: {dict(response.headers)}")
-        logger.info(f"📤 原始响应体长度: {len(response.content)} bytes")
+        raw_body = b"".join(raw_chunks)
+        raw_chunks.clear()
+        logger.info(f"📤 原始响应体长度: {len(raw_body)} bytes")
         
-        # 获取原始响应文本用于工具调用检测
-        raw_response_text = ""
-        try:
-            raw_response_text = response.content.decode('utf-8', errors='ignore')
-            logger.info(f"🔍 原始响应文本长度: {len(raw_response_text)}")
-            logger.info(f"🔍 原始响应预览(前1000字符): {raw_response_text[:1000]}")
+        # 绝大多数响应不含 bracket 格式工具调用，先在字节层面判断，缺失时整条 bracket 解析流程都可跳过
+        has_called_marker = b"[Called" in raw_body
+        
+        # 原始响应文本只用于 bracket 检测，没有 [Called 标记时不解码整个响应体
+        raw_response_text = raw_body.decode('utf-8', errors='ignore') if has_called_marker else ""
+        
+        # 预览和 [Called 位置只用于日志，INFO 未启用时不做切片和扫描
+        if logger.isEnabledFor(logging.INFO):
+            if has_called_marker:
+                logger.info("🔍 原始响应文本长度: %d", len(raw_response_text))
+                preview = raw_response_text[:1000]
+            else:
+                # 每个字符最多 4 个字节，只解码足够预览的前缀
+                preview = raw_body[:4000].decode('utf-8', errors='ignore')[:1000]
+            logger.info("🔍 原始响应预览(前1000字符): %s", preview)
             
             # 检查是否包含工具调用标记
-            if "[Called" in raw_response_text:
+            if has_called_marker:
                 logger.info("✅ 原始响应中发现 [Called 标记")
-                called_positions = [m.start() for m in re.finditer(r'\[Called', raw_response_text)]
-                logger.info(f"🎯 [Called 出现位置: {called_positions}")
+                # 字面量查找用 str.find 循环，比正则更快且不创建 Match 对象
+                called_positions = []
+                pos = raw_response_text.find("[Called")
+                while pos != -1:
+                    called_positions.append(pos)
+                    pos = raw_response_text.find("[Called", pos + 7)
+                logger.info("🎯 [Called 出现位置: %s", called_positions)
             else:
                 logger.info("❌ 原始响应中未发现 [Called 标记")
-                
-        except Exception as e:
-            logger.error(f"❌ 解码原始响应失败: {e}")
-        
-        # 使用 CodeWhispererStreamParser 一次性解析整个响应体
-        parser = CodeWhispererStreamParser()
-        events = parser.parse(response.content)
         
-        full_response_text = ""
+        # 文本与参数片段先收集到列表，最后一次性 join，避免循环中反复拼接字符串
+        text_chunks = []
         tool_calls = []
         current_tool_call_dict = None
+        current_tool_args = []
 
         logger.info(f"🔄 解析到 {len(events)} 个事件，开始处理...")
         
-        # 记录每个事件的详细信息
-        for i, event in enumerate(events):
-            logger.info(f"📋 事件 {i}: {event}")
+        # 记录每个事件的详细信息（仅在 DEBUG 级别下遍历格式化）
+        if logger.isEnabledFor(logging.DEBUG):
+            for i, event in enumerate(events):
+                logger.debug("📋 事件 %d: %s", i, event)
 
         for event in events:
             # 优先处理结构化工具调用事件
             if "name" in event and "toolUseId" in event:
-                logger.info(f"🔧 发现结构化工具调用事件: {event}")
+                logger.info("🔧 发现结构化工具调用事件: %s", event)
                 # 如果是新的工具调用，则初始化
                 if not current_tool_call_dict:
                     current_tool_call_dict = {
@@ -246,22 +325,23 @@ async def create_non_streaming_response(request: ChatCompletionRequest):
                             "arguments": ""
                         }
                     }
-                    logger.info(f"🆕 开始解析工具调用: {current_tool_call_dict['function']['name']}")
+                    logger.info("🆕 开始解析工具调用: %s", current_tool_call_dict["function"]["name"])
 
                 # 累积参数
                 if "input" in event:
-                    current_tool_call_dict["function"]["arguments"] += event.get("input", "")
-                    logger.info(f"📝 累积参数: {event.get('input', '')}")
+                    current_tool_args.append(event.get("input", ""))
+                    logger.info("📝 累积参数: %s", event.get("input", ""))
 
                 # 工具调用结束
                 if event.get("stop"):
-                    logger.info(f"✅ 完成工具调用: {current_tool_call_dict['function']['name']}")
-                    # 验证并标准化参数为JSON字符串
+                    current_tool_call_dict["function"]["arguments"] = "".join(current_tool_args)
+                    current_tool_args = []
+                    logger.info("✅ 完成工具调用: %s", current_tool_call_dict["function"]["name"])
+                    # 验证参数是合法的JSON；校验通过的原始字符串本身就是合法参数，无需再序列化一遍
                     try:
-                        args = json.loads(current_tool_call_dict["function"]["arguments"])
-                        current_tool_call_dict["function"]["arguments"] = json.dumps(args, ensure_ascii=False)
+                        orjson.loads(current_tool_call_dict["function"]["arguments"])
                         logger.info(f"✅ 工具调用参数验证成功")
-                    except json.JSONDecodeError as e:
+                    except orjson.JSONDecodeError as e:
                         logger.warning(f"⚠️ 工具调用的参数不是有效的JSON: {current_tool_call_dict['function']['arguments']}")
                         logger.warning(f"⚠️ JSON错误: {e}")
                     
@@ -271,49 +351,56 @@ async def create_non_streaming_response(request: ChatCompletionRequest):
             # 处理普通文本内容事件
             elif "content" in event:
                 content = event.get("content", "")
-                full_response_text += content
-                logger.info(f"📄 添加文本内容: {content[:100]}...")
+                text_chunks.append(content)
+                logger.info("📄 添加文本内容: %.100s...", content)
 
         # 如果流在工具调用中间意外结束，也将其添加
         if current_tool_call_dict:
             logger.warning("⚠️ 响应流在工具调用结束前终止，仍尝试添加。")
+            current_tool_call_dict["function"]["arguments"] = "".join(current_tool_args)
             tool_calls.append(ToolCall(**current_tool_call_dict))
 
+        full_response_text = "".join(text_chunks)
         logger.info(f"📊 事件处理完成 - 文本长度: {len(full_response_text)}, 结构化工具调用: {len(tool_calls)}")
 
         # 检查解析后文本中的 bracket 格式工具调用
-        logger.info("🔍 开始检查解析后文本中的bracket格式工具调用...")
-        bracket_tool_calls = parse_bracket_tool_calls(full_response_text)
-        if bracket_tool_calls:
-            logger.info(f"✅ 在解析后文本中发现 {len(bracket_tool_calls)} 个 bracket 格式工具调用")
-            tool_calls.extend(bracket_tool_calls)
+        bracket_spans = []
+        if "[Called" in full_response_text:
+            logger.info("🔍 开始检查解析后文本中的bracket格式工具调用...")
+            bracket_spans = parse_bracket_tool_calls_with_spans(full_response_text)
+        if bracket_spans:
+            logger.info(f"✅ 在解析后文本中发现 {len(bracket_spans)} 个 bracket 格式工具调用")
+            tool_calls.extend(tc for tc, _, _ in bracket_spans)
             
-            # 从响应文本中移除工具调用文本
-            for tc in bracket_tool_calls:
-                # 构建精确的正则表达式来匹配这个特定的工具调用
-                func_name = tc.function.get("name", "unknown")
-                # 转义函数名中的特殊字符
-                escaped_name = re.escape(func_name)
-                # 匹配 [Called FunctionName with args: {...}]
-                pattern = r'\[Called\s+' + escaped_name + r'\s+with\s+args:\s*\{[^}]*(?:\{[^}]*\}[^}]*)*\}\s*\]'
-                full_response_text = re.sub(pattern, '', full_response_text, flags=re.DOTALL)
+            # 按解析器给出的位置一次性切除工具调用文本（位置按出现顺序且互不重叠）
+            kept = []
+            cursor = 0
+            for _, start, end in bracket_spans:
+                kept.append(full_response_text[cursor:start])
+                cursor = end
+            kept.append(full_response_text[cursor:])
+            full_response_text = "".join(kept)
             
             # 清理多余的空白
-            full_response_text = re.sub(r'\s+', ' ', full_response_text).strip()
+            full_response_text = _WS_RE.sub(' ', full_response_text).strip()
 
         # 关键修复：检查原始响应中的 bracket 格式工具调用
-        logger.info("🔍 开始检查原始响应中的bracket格式工具调用...")
-        raw_bracket_tool_calls = parse_bracket_tool_calls(raw_response_text)
-        if raw_bracket_tool_calls and isinstance(raw_bracket_tool_calls, list):
-            logger.info(f"✅ 在原始响应中发现 {len(raw_bracket_tool_calls)} 个 bracket 格式工具调用")
-            tool_calls.extend(raw_bracket_tool_calls)
-        else:
-            logger.info("❌ 原始响应中未发现bracket格式工具调用")
+        if has_called_marker:
+            logger.info("🔍 开始检查原始响应中的bracket格式工具调用...")
+            raw_bracket_tool_calls = parse_bracket_tool_calls(raw_response_text)
+            if raw_bracket_tool_calls and isinstance(raw_bracket_tool_calls, list):
+                logger.info(f"✅ 在原始响应中发现 {len(raw_bracket_tool_calls)} 个 bracket 格式工具调用")
+                tool_calls.extend(raw_bracket_tool_calls)
+            else:
+                logger.info("❌ 原始响应中未发现bracket格式工具调用")
 
-        # 去重工具调用
-        logger.info(f"🔄 去重前工具调用数量: {len(tool_calls)}")
-        unique_tool_calls = deduplicate_tool_calls(tool_calls)
-        logger.info(f"🔄 去重后工具调用数量: {len(unique_tool_calls)}")
+        # 去重工具调用（没有工具调用时无需去重）
+        if tool_calls:
+            logger.info(f"🔄 去重前工具调用数量: {len(tool_calls)}")
+            unique_tool_calls = deduplicate_tool_calls(tool_calls)
+            logger.info(f"🔄 去重后工具调用数量: {len(unique_tool_calls)}")
+        else:
+            unique_tool_calls = []
 
         # 根据是否有工具调用来构建响应
         if unique_tool_calls:
@@ -321,7 +408,8 @@ async def create_non_streaming_response(request: ChatCompletionRequest):
             for i, tc in enumerate(unique_tool_calls):
                 logger.info(f"🔧 工具调用 {i}: {tc.function.get('name', 'unknown')}")
             
-            response_message = ResponseMessage(
+            # 以下响应对象都由已解析好的数据构建，跳过 Pydantic 校验
+            response_message = ResponseMessage.model_construct(
                 role="assistant",
                 content=None,  # OpenAI规范：当有tool_calls时，content必须为None
                 tool_calls=unique_tool_calls
@@ -333,40 +421,42 @@ async def create_non_streaming_response(request: ChatCompletionRequest):
             content = full_response_text.strip() if full_response_text.strip() else "I understand."
             logger.info(f"📄 最终文本内容: {content[:200]}...")
             
-            response_message = ResponseMessage(
+            response_message = ResponseMessage.model_construct(
                 role="assistant",
                 content=content
             )
             finish_reason = "stop"
 
-        choice = Choice(
+        choice = Choice.model_construct(
             index=0,
             message=response_message,
             finish_reason=finish_reason
         )
 
         usage = create_usage_stats(
-            prompt_text=" ".join([msg.get_content_text() for msg in request.messages]),
+            prompt_text="",
+            prompt_tokens=estimate_prompt_tokens(request.messages),
             completion_text=full_response_text if not unique_tool_calls else ""
         )
 
-        chat_response = ChatCompletionResponse(
+        chat_response = ChatCompletionResponse.model_construct(
             model=request.model,
             choices=[choice],
             usage=usage
         )
         
-        logger.info(f"📤 最终非流式响应构建完成")
-        logger.info(f"📤 响应类型: {'工具调用' if unique_tool_calls else '文本内容'}")
-        logger.info(f"📤 完整响应: {chat_response.model_dump_json(indent=2, exclude_none=True)}")
-        return chat_response
+        # 只序列化一次：日志与响应体共用同一份 payload，直接交给 JSONResponse
+        payload = chat_response.model_dump(mode="json")
+        logger.info("📤 最终非流式响应构建完成")
+        logger.info("📤 响应类型: %s", "工具调用" if unique_tool_calls else "文本内容")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("📤 完整响应: %s", orjson.dumps(payload).decode())
+        return JSONResponse(content=payload)
         
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"❌ 非流式响应处理出错: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("❌ 非流式响应处理出错: %s", e)
         raise HTTPException(
             status_code=500,
             detail={
@@ -380,6 +470,215 @@ async def create_non_streaming_response(request: ChatCompletionRequest):
         )
 
 
+@dataclass(slots=True)
+class StreamState:
+    """OpenAI 流式响应的状态，所有处理函数把输出帧追加到 pending"""
+    response_id: str
+    model: str
+    created: int
+    in_tool: bool = False
+    sent_role: bool = False
+    idx: int = 0
+    tool_count: int = 0
+    buf: str = ""
+    # 未闭合的工具调用按到达顺序分段保存，闭合时才拼接，避免每块都复制整段已收到的文本
+    incomplete: List[str] = field(default_factory=list)
+    # incomplete 的括号扫描进度 (末尾待续的反斜杠, 括号深度, 是否在字符串内)，新内容只需接着扫描
+    incomplete_scan: Tuple[str, int, bool] = ("", 0, False)
+    pending: bytearray = field(default_factory=bytearray)
+    # 工具调用开始/结束等帧需要立即写出，不等待合并时间窗口
+    force_flush: bool = False
+    frame_head: bytes = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        # id/created/model 等字段在整个流中不变，只序列化一次；去掉末尾的 "}" 以便逐块拼接 choices
+        # 字段顺序与 ChatCompletionStreamResponse 的 model_dump_json(exclude_none=True) 一致
+        head = orjson.dumps({
+            "id": self.response_id,
+            "object": "chat.completion.chunk",
+            "created": self.created,
+            "model": self.model,
+            "system_fingerprint": "fp_ki2api_v3",
+        })
+        self.frame_head = _SSE_PREFIX + head[:-1] + b',"choices":[{"index":0,"delta":'
+
+    def emit(self, delta: dict, finish_reason: Optional[str] = None) -> None:
+        pending = self.pending
+        pending += self.frame_head
+        pending += orjson.dumps(delta)
+        if finish_reason is not None:
+            pending += b',"finish_reason":'
+            pending += orjson.dumps(finish_reason)
+        pending += b'}]}'
+        pending += _SSE_SUFFIX
+
+    def emit_with_role(self, delta: dict) -> None:
+        if not self.sent_role:
+            delta["role"] = "assistant"
+            self.sent_role = True
+        self.emit(delta)
+
+    def take_pending(self) -> bytes:
+        frames = bytes(self.pending)
+        self.pending.clear()
+        self.force_flush = False
+        return frames
+
+
+def _emit_parsed_tool_call(state: StreamState, parsed_call: ToolCall) -> None:
+    state.emit_with_role({
+        "tool_calls": [{
+            "index": state.idx,
+            "id": parsed_call.id,
+            "type": "function",
+            "function": {
+                "name": parsed_call.function["name"],
+                "arguments": parsed_call.function["arguments"]
+            }
+        }]
+    })
+    state.idx += 1
+    state.tool_count += 1
+    state.force_flush = True
+
+
+def handle_tool_event(state: StreamState, event: dict) -> None:
+    """处理结构化工具调用事件"""
+    logger.debug("🎯 STREAM: Found structured tool call event: %s", event)
+    if not state.in_tool:
+        state.in_tool = True
+        state.emit_with_role({
+            "tool_calls": [{
+                "index": state.idx,
+                "id": event.get("toolUseId"),
+                "type": "function",
+                "function": {"name": event.get("name"), "arguments": ""}
+            }]
+        })
+        state.force_flush = True
+
+    arg_chunk_str = event.get("input", "")
+    if arg_chunk_str:
+        state.emit({
+            "tool_calls": [{
+                "index": state.idx,
+                "function": {"arguments": arg_chunk_str}
+            }]
+        })
+
+    if event.get("stop"):
+        state.in_tool = False
+        state.idx += 1
+        state.tool_count += 1
+        state.force_flush = True
+
+
+def _partial_marker_len(buf: str) -> int:
+    """返回 buf 末尾与 "[Called" 前缀重合的长度（不含完整标记），没有则为 0"""
+    # "[" 只出现在标记开头，所以只需检查末尾 6 个字符中最后一个 "[" 之后的部分
+    tail = buf[-6:]
+    bracket = tail.rfind("[")
+    if bracket == -1:
+        return 0
+    return len(tail) - bracket if "[Called".startswith(tail[bracket:]) else 0
+
+
+def _emit_bracket_call(state: StreamState, call_text: str) -> None:
+    """解析一段完整的 [Called ...] 文本，成功则作为工具调用发送"""
+    parsed_call = parse_single_tool_call(call_text)
+    if parsed_call:
+        logger.info("📤 STREAM: Sending tool call: %s", parsed_call.function["name"])
+        _emit_parsed_tool_call(state, parsed_call)
+
+
+def handle_content(state: StreamState, text: str) -> None:
+    """处理普通文本内容，从中切出 bracket 格式的工具调用"""
+    if not text:
+        return
+
+    # 常见情况：没有待处理的残留且新内容不含 "["，不可能构成工具调用，直接发送
+    if not state.incomplete and not state.buf and "[" not in text:
+        state.emit_with_role({"content": text})
+        return
+
+    if state.incomplete:
+        # 有未闭合的工具调用：只扫描新内容，带上次留下的深度和字符串状态继续查找结束括号
+        carry, depth, in_string = state.incomplete_scan
+        scan_text = carry + text
+        bracket_end, scan_pos, depth, in_string = scan_matching_bracket(scan_text, 0, depth, in_string)
+        if bracket_end == -1:
+            state.incomplete.append(text)
+            state.incomplete_scan = (scan_text[scan_pos:], depth, in_string)
+            return
+
+        split = bracket_end + 1 - len(carry)
+        state.incomplete.append(text[:split])
+        _emit_bracket_call(state, "".join(state.incomplete))
+        state.incomplete = []
+        buf = text[split:]
+    else:
+        buf = state.buf + text
+
+    while True:
+        called_start = buf.find("[Called")
+        if called_start == -1:
+            # 没有工具调用，发送所有内容；末尾可能是被分块截断的 "[Called" 前缀，留到下次与新内容一起查找
+            keep = _partial_marker_len(buf)
+            if len(buf) > keep:
+                state.emit_with_role({"content": buf[:len(buf) - keep]})
+            buf = buf[len(buf) - keep:] if keep else ""
+            break
+
+        # 发送 [Called 之前的文本
+        if called_start > 0:
+            text_before = buf[:called_start]
+            if text_before.strip():
+                state.emit_with_role({"content": text_before})
+
+        remaining_text = buf[called_start:]
+        bracket_end, scan_pos, depth, in_string = scan_matching_bracket(remaining_text, 1, 1, False)
+        if bracket_end == -1:
+            # 工具调用不完整，保留等待更多数据
+            state.incomplete = [remaining_text]
+            state.incomplete_scan = (remaining_text[scan_pos:], depth, in_string)
+            buf = ""
+            break
+
+        _emit_bracket_call(state, remaining_text[:bracket_end + 1])
+
+        # 继续处理剩余内容
+        buf = remaining_text[bracket_end + 1:]
+
+    state.buf = buf
+
+
+def flush(state: StreamState) -> bytes:
+    """流结束：处理残留的工具调用和文本，返回剩余的全部帧（含结束块和 [DONE]）"""
+    if state.incomplete:
+        state.buf = "".join(state.incomplete) + state.buf
+        state.incomplete = []
+
+        if state.buf.startswith("[Called"):
+            bracket_end = find_matching_bracket(state.buf, 0)
+            if bracket_end != -1:
+                parsed_call = parse_single_tool_call(state.buf[:bracket_end + 1])
+                if parsed_call:
+                    _emit_parsed_tool_call(state, parsed_call)
+                    state.buf = state.buf[bracket_end + 1:]
+
+    # 发送任何剩余的内容
+    if state.buf.strip():
+        logger.info("📤 Sending remaining content: %d chars", len(state.buf))
+        state.emit_with_role({"content": state.buf})
+    state.buf = ""
+
+    finish_reason = "tool_calls" if state.tool_count > 0 else "stop"
+    logger.info("🏁 STREAM: Completed with %d tool calls, finish_reason=%s", state.tool_count, finish_reason)
+    state.emit({}, finish_reason=finish_reason)
+    state.pending += _SSE_DONE
+    return state.take_pending()
+
+
 async def create_streaming_response(request: ChatCompletionRequest):
     """
     Handles streaming chat completion requests.
@@ -387,22 +686,16 @@ async def create_streaming_response(request: ChatCompletionRequest):
     """
     
     async def generate_stream():
-        response_id = f"chatcmpl-{uuid.uuid4()}"
-        created = int(time.time())
-        parser = CodeWhispererStreamParser()
-
-        # --- 状态变量 ---
-        is_in_tool_call = False
-        sent_role = False
-        current_tool_call_index = 0
-        streamed_tool_calls_count = 0
-        content_buffer = ""
-        incomplete_tool_call = ""
+        state = StreamState(
+            response_id=f"chatcmpl-{uuid.uuid4()}",
+            model=request.model,
+            created=int(time.time()),
+        )
 
         # 准备请求 - 使用多账号 token 管理器
         token = await token_manager.get_token()
         if not token:
-            yield f"data: {json.dumps({'error': {'message': 'No access token available. Please check your KIRO_AUTH_CONFIG configuration.', 'type': 'authentication_error'}})}\n\n"
+            yield _sse_error("No access token available. Please check your KIRO_AUTH_CONFIG configuration.", "authentication_error")
             return
 
         request_data = build_codewhisperer_request(request)
@@ -412,277 +705,128 @@ async def create_streaming_response(request: ChatCompletionRequest):
             "Accept": "text/event-stream"
         }
 
-        # 使用 httpx.Timeout 分离连接超时和读取超时，避免长对话被截断
-        timeout = httpx.Timeout(connect=30.0, read=None, write=30.0, pool=30.0)
+        parser = acquire_parser()
 
         try:
-            async with httpx.AsyncClient(timeout=timeout) as client:
-                # 支持 403 重试的循环
-                max_retries = 2
-                for attempt in range(max_retries):
-                    async with client.stream("POST", KIRO_BASE_URL, headers=headers, json=request_data) as response:
-                        logger.info(f"📤 STREAM RESPONSE STATUS: {response.status_code} (attempt {attempt + 1})")
-
-                        # 处理 403 - 刷新 token 并重试
-                        if response.status_code == 403 and attempt < max_retries - 1:
-                            logger.info("收到403响应，尝试刷新token...")
-                            new_token = await token_manager.refresh_tokens()
+            client = get_http_client()
+            # 请求体只序列化一次，重试时复用
+            body = orjson.dumps(request_data)
+            # 支持 403 重试的循环
+            max_retries = 2
+            for attempt in range(max_retries):
+                async with client.stream("POST", KIRO_BASE_URL, headers=headers, content=body) as response:
+                    logger.info(f"📤 STREAM RESPONSE STATUS: {response.status_code} (attempt {attempt + 1})")
+
+                    # 处理 403 - 刷新 token 并重试
+                    if response.status_code == 403 and attempt < max_retries - 1:
+                        logger.info("收到403响应，尝试刷新token...")
+                        new_token = await token_manager.refresh_tokens()
+                        if new_token:
+                            headers["Authorization"] = f"Bearer {new_token}"
+                            continue  # 重试
+                        else:
+                            # 尝试切换到下一个账号
+                            token_manager.mark_token_error()
+                            new_token = await token_manager.get_token()
                             if new_token:
                                 headers["Authorization"] = f"Bearer {new_token}"
-                                continue  # 重试
-                            else:
-                                # 尝试切换到下一个账号
-                                token_manager.mark_token_error()
-                                new_token = await token_manager.get_token()
-                                if new_token:
-                                    headers["Authorization"] = f"Bearer {new_token}"
-                                    continue
-                                yield f"data: {json.dumps({'error': {'message': 'Token refresh failed and no backup accounts available', 'type': 'authentication_error'}})}\n\n"
-                                return
-
-                        if response.status_code == 429:
-                            logger.warning("收到429响应（速率限制），尝试切换账号...")
-                            # 标记当前 token 已耗尽，切换到下一个账号
-                            token_manager.mark_token_exhausted("rate_limit_429")
-                            
-                            if attempt < max_retries - 1:
-                                new_token = await token_manager.get_token()
-                                if new_token:
-                                    headers["Authorization"] = f"Bearer {new_token}"
-                                    logger.info("已切换到新账号，重试请求...")
-                                    continue
-                            
-                            yield f"data: {json.dumps({'error': {'message': 'All accounts rate limited. Please try again later.', 'type': 'rate_limit_error'}})}\n\n"
+                                continue
+                            yield _sse_error("Token refresh failed and no backup accounts available", "authentication_error")
                             return
 
-                        if response.status_code != 200:
-                            yield f"data: {json.dumps({'error': {'message': f'API error: {response.status_code}', 'type': 'api_error'}})}\n\n"
-                            return
-
-                        # 真正的流式处理：边收边推
-                        async for chunk in response.aiter_bytes():
-                            events = parser.parse(chunk)
-                            
-                            for event in events:
-                                # --- 处理结构化工具调用事件 ---
-                                if "name" in event and "toolUseId" in event:
-                                    logger.info(f"🎯 STREAM: Found structured tool call event: {event}")
-                                    if not is_in_tool_call:
-                                        is_in_tool_call = True
-                                        
-                                        delta_start = {
-                                            "tool_calls": [{
-                                                "index": current_tool_call_index,
-                                                "id": event.get("toolUseId"),
-                                                "type": "function",
-                                                "function": {"name": event.get("name"), "arguments": ""}
-                                            }]
-                                        }
-                                        if not sent_role:
-                                            delta_start["role"] = "assistant"
-                                            sent_role = True
-
-                                        start_chunk = ChatCompletionStreamResponse(
-                                            id=response_id, model=request.model, created=created,
-                                            choices=[StreamChoice(index=0, delta=delta_start)]
-                                        )
-                                        yield f"data: {start_chunk.model_dump_json(exclude_none=True)}\n\n"
-
-                                    if "input" in event:
-                                        arg_chunk_str = event.get("input", "")
-                                        if arg_chunk_str:
-                                            arg_chunk_delta = {
-                                                "tool_calls": [{
-                                                    "index": current_tool_call_index,
-                                                    "function": {"arguments": arg_chunk_str}
-                                                }]
-                                            }
-                                            arg_chunk_resp = ChatCompletionStreamResponse(
-                                                id=response_id, model=request.model, created=created,
-                                                choices=[StreamChoice(index=0, delta=arg_chunk_delta)]
-                                            )
-                                            yield f"data: {arg_chunk_resp.model_dump_json(exclude_none=True)}\n\n"
-
-                                    if event.get("stop"):
-                                        is_in_tool_call = False
-                                        current_tool_call_index += 1
-                                        streamed_tool_calls_count += 1
-
-                                # --- 处理普通文本内容事件 ---
-                                elif "content" in event and not is_in_tool_call:
-                                    content_text = event.get("content", "")
-                                    if content_text:
-                                        # 如果有不完整的工具调用，先合并再处理
-                                        if incomplete_tool_call:
-                                            content_buffer = incomplete_tool_call + content_text
-                                            incomplete_tool_call = ""
-                                        else:
-                                            content_buffer += content_text
-                                        
-                                        # 处理 bracket 格式的工具调用
-                                        while True:
-                                            called_start = content_buffer.find("[Called")
-                                            
-                                            if called_start == -1:
-                                                # 没有工具调用，发送所有内容
-                                                if content_buffer:
-                                                    delta_content = {"content": content_buffer}
-                                                    if not sent_role:
-                                                        delta_content["role"] = "assistant"
-                                                        sent_role = True
-                                                    
-                                                    content_chunk = ChatCompletionStreamResponse(
-                                                        id=response_id, model=request.model, created=created,
-                                                        choices=[StreamChoice(index=0, delta=delta_content)]
-                                                    )
-                                                    yield f"data: {content_chunk.model_dump_json(exclude_none=True)}\n\n"
-                                                    content_buffer = ""
-                                                break
-                                            
-                                            # 发送 [Called 之前的文本
-                                            if called_start > 0:
-                                                text_before = content_buffer[:called_start]
-                                                if text_before.strip():
-                                                    delta_content = {"content": text_before}
-                                                    if not sent_role:
-                                                        delta_content["role"] = "assistant"
-                                                        sent_role = True
-                                                    
-                                                    content_chunk = ChatCompletionStreamResponse(
-                                                        id=response_id, model=request.model, created=created,
-                                                        choices=[StreamChoice(index=0, delta=delta_content)]
-                                                    )
-                                                    yield f"data: {content_chunk.model_dump_json(exclude_none=True)}\n\n"
-                                            
-                                            # 查找对应的结束 ]
-                                            remaining_text = content_buffer[called_start:]
-                                            bracket_end = find_matching_bracket(remaining_text, 0)
-                                            
-                                            if bracket_end == -1:
-                                                # 工具调用不完整，保留等待更多数据
-                                                incomplete_tool_call = remaining_text
-                                                content_buffer = ""
-                                                break
-                                            
-                                            # 提取完整的工具调用
-                                            tool_call_text = remaining_text[:bracket_end + 1]
-                                            parsed_call = parse_single_tool_call(tool_call_text)
-                                            
-                                            if parsed_call:
-                                                delta_tool = {
-                                                    "tool_calls": [{
-                                                        "index": current_tool_call_index,
-                                                        "id": parsed_call.id,
-                                                        "type": "function",
-                                                        "function": {
-                                                            "name": parsed_call.function["name"],
-                                                            "arguments": parsed_call.function["arguments"]
-                                                        }
-                                                    }]
-                                                }
-                                                if not sent_role:
-                                                    delta_tool["role"] = "assistant"
-                                                    sent_role = True
-                                                
-                                                logger.info(f"📤 STREAM: Sending tool call: {parsed_call.function['name']}")
-                                                tool_chunk = ChatCompletionStreamResponse(
-                                                    id=response_id, model=request.model, created=created,
-                                                    choices=[StreamChoice(index=0, delta=delta_tool)]
-                                                )
-                                                yield f"data: {tool_chunk.model_dump_json(exclude_none=True)}\n\n"
-                                                current_tool_call_index += 1
-                                                streamed_tool_calls_count += 1
-                                            
-                                            # 更新缓冲区，继续处理剩余内容
-                                            content_buffer = remaining_text[bracket_end + 1:]
-                                            incomplete_tool_call = ""
-
-                        # 流结束后处理 parser buffer 中的残留数据
-                        logger.info(f"🔄 Stream ended, parser buffer remaining: {parser.get_remaining_buffer_size()} bytes")
+                    if response.status_code == 429:
+                        logger.warning("收到429响应（速率限制），尝试切换账号...")
+                        # 标记当前 token 已耗尽，切换到下一个账号
+                        token_manager.mark_token_exhausted("rate_limit_429")
                         
-                        if parser.has_remaining_data():
-                            flush_events = parser.flush()
-                            logger.info(f"🔄 Flushed {len(flush_events)} events from parser buffer")
-                            
-                            for event in flush_events:
-                                if "content" in event and not is_in_tool_call:
-                                    content_text = event.get("content", "")
-                                    if content_text:
-                                        content_buffer += content_text
-                                        logger.info(f"📝 Recovered content from flush: {len(content_text)} chars")
-                        
-                        # 处理 incomplete_tool_call 中的残留内容
-                        if incomplete_tool_call:
-                            content_buffer = incomplete_tool_call + content_buffer
-                            incomplete_tool_call = ""
-                            
-                            called_start = content_buffer.find("[Called")
-                            if called_start == 0:
-                                bracket_end = find_matching_bracket(content_buffer, 0)
-                                if bracket_end != -1:
-                                    tool_call_text = content_buffer[:bracket_end + 1]
-                                    parsed_call = parse_single_tool_call(tool_call_text)
-                                    
-                                    if parsed_call:
-                                        delta_tool = {
-                                            "tool_calls": [{
-                                                "index": current_tool_call_index,
-                                                "id": parsed_call.id,
-                                                "type": "function",
-                                                "function": {
-                                                    "name": parsed_call.function["name"],
-                                                    "arguments": parsed_call.function["arguments"]
-                                                }
-                                            }]
-                                        }
-                                        if not sent_role:
-                                            delta_tool["role"] = "assistant"
-                                            sent_role = True
-                                        
-                                        tool_chunk = ChatCompletionStreamResponse(
-                                            id=response_id, model=request.model, created=created,
-                                            choices=[StreamChoice(index=0, delta=delta_tool)]
-                                        )
-                                        yield f"data: {tool_chunk.model_dump_json(exclude_none=True)}\n\n"
-                                        current_tool_call_index += 1
-                                        streamed_tool_calls_count += 1
-                                        
-                                        content_buffer = content_buffer[bracket_end + 1:]
-
-                        # 发送任何剩余的内容
-                        if content_buffer.strip():
-                            logger.info(f"📤 Sending remaining content: {len(content_buffer)} chars")
-                            delta_content = {"content": content_buffer}
-                            if not sent_role:
-                                delta_content["role"] = "assistant"
-                                sent_role = True
-                            
-                            content_chunk = ChatCompletionStreamResponse(
-                                id=response_id, model=request.model, created=created,
-                                choices=[StreamChoice(index=0, delta=delta_content)]
-                            )
-                            yield f"data: {content_chunk.model_dump_json(exclude_none=True)}\n\n"
-
-                        # --- 流结束 ---
-                        finish_reason = "tool_calls" if streamed_tool_calls_count > 0 else "stop"
-                        logger.info(f"🏁 STREAM: Completed with {streamed_tool_calls_count} tool calls, finish_reason={finish_reason}")
-                        end_chunk = ChatCompletionStreamResponse(
-                            id=response_id, model=request.model, created=created,
-                            choices=[StreamChoice(index=0, delta={}, finish_reason=finish_reason)]
-                        )
-                        yield f"data: {end_chunk.model_dump_json(exclude_none=True)}\n\n"
+                        if attempt < max_retries - 1:
+                            new_token = await token_manager.get_token()
+                            if new_token:
+                                headers["Authorization"] = f"Bearer {new_token}"
+                                logger.info("已切换到新账号，重试请求...")
+                                continue
                         
-                        yield "data: [DONE]\n\n"
-                        return  # 成功完成，退出重试循环
+                        yield _sse_error("All accounts rate limited. Please try again later.", "rate_limit_error")
+                        return
+
+                    if response.status_code != 200:
+                        yield _sse_error(f"API error: {response.status_code}", "api_error")
+                        return
+
+                    # 真正的流式处理：边收边推
+                    # 帧先累积在 state.pending 中，攒够 _STREAM_FLUSH_BYTES 或距上次写出超过
+                    # _STREAM_FLUSH_INTERVAL 秒时才写出一次，减少细碎增量产生的 send 调用；
+                    # 工具调用开始和结束的帧（state.force_flush）立即写出
+                    loop = asyncio.get_running_loop()
+                    reads = response.aiter_bytes().__aiter__()
+                    next_read = None
+                    last_flush = loop.time()
+                    try:
+                        while True:
+                            if state.pending:
+                                # 有待写出的数据时，读取在后台进行，等待不超过剩余的合并时间窗口
+                                if next_read is None:
+                                    next_read = asyncio.ensure_future(reads.__anext__())
+                                timeout = last_flush + _STREAM_FLUSH_INTERVAL - loop.time()
+                                done, _ = await asyncio.wait((next_read,), timeout=max(timeout, 0))
+                                if not done:
+                                    yield state.take_pending()
+                                    last_flush = loop.time()
+                                    continue
+                            try:
+                                if next_read is not None:
+                                    chunk = await next_read
+                                else:
+                                    chunk = await reads.__anext__()
+                            except StopAsyncIteration:
+                                break
+                            finally:
+                                next_read = None
+
+                            for event in parser.parse(chunk):
+                                if "name" in event and "toolUseId" in event:
+                                    handle_tool_event(state, event)
+                                elif "content" in event and not state.in_tool:
+                                    handle_content(state, event.get("content", ""))
+
+                            if state.force_flush or len(state.pending) >= _STREAM_FLUSH_BYTES or (
+                                state.pending and loop.time() - last_flush >= _STREAM_FLUSH_INTERVAL
+                            ):
+                                yield state.take_pending()
+                                last_flush = loop.time()
+                    finally:
+                        # 客户端断开等提前退出时，取消仍在进行的后台读取，并等它结束后再关闭响应；
+                        # 读取结果已经不再需要，它自身的异常也一并忽略
+                        if next_read is not None:
+                            next_read.cancel()
+                            with suppress(asyncio.CancelledError, Exception):
+                                await next_read
+
+                    # 流结束后处理 parser buffer 中的残留数据
+                    logger.info("🔄 Stream ended, parser buffer remaining: %d bytes", parser.get_remaining_buffer_size())
+
+                    if parser.has_remaining_data():
+                        flush_events = parser.flush()
+                        logger.info("🔄 Flushed %d events from parser buffer", len(flush_events))
+
+                        for event in flush_events:
+                            if "content" in event and not state.in_tool:
+                                content_text = event.get("content", "")
+                                if content_text:
+                                    state.buf += content_text
+                                    logger.info("📝 Recovered content from flush: %d chars", len(content_text))
+
+                    yield flush(state)
+                    return  # 成功完成，退出重试循环
 
         except httpx.HTTPStatusError as e:
             logger.error(f"HTTP ERROR in stream: {e}")
-            yield f"data: {json.dumps({'error': {'message': str(e), 'type': 'api_error'}})}\n\n"
+            yield _sse_error(str(e), "api_error")
         except Exception as e:
-            logger.error(f"Stream error: {e}")
-            import traceback
-            traceback.print_exc()
-            yield f"data: {json.dumps({'error': {'message': str(e), 'type': 'internal_error'}})}\n\n"
+            logger.exception("Stream error: %s", e)
+            yield _sse_error(str(e), "internal_error")
+        finally:
+            release_parser(parser)
 
     return StreamingResponse(
         generate_stream(),